@@ -0,0 +1,79 @@
+"""
+Benchmark of the FactorAnalysis fit on growing numbers of features
+
+For each number of features, synthetic data generated by a few factors is
+fitted with FactorAnalysis.analyse (symmetric partial eigendecomposition
+and analytic gradient), and, up to --reference-max features, with the
+previous engine (full general eigendecomposition and finite-difference
+gradient). The wall time of both fits and the largest difference of the
+implied Loadings * Loadings^T are reported.
+
+Usage:
+    python benchmarks/bench_factor_analysis.py --features 50 100 300 500
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import scipy as sp
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from xuerui_stat import FactorAnalysis
+
+
+def reference_loadings(corr_matrix, n_factors):
+    """
+    loadings by the general eigensolver and finite differences
+    """
+    def fit_model(psi, return_error=True):
+        np.fill_diagonal(corr_matrix, 1 - psi)
+        values, vectors = np.linalg.eig(corr_matrix)
+        sorted_indices = np.argsort(values)[::-1][:n_factors]
+        loadings = vectors[:, sorted_indices] * np.sqrt(np.maximum(values[sorted_indices], 0))
+        if return_error:
+            return np.sum((corr_matrix - loadings @ loadings.T)**2)
+        return loadings
+    p = len(corr_matrix)
+    start = 1 - abs(corr_matrix - np.eye(p)).max(axis=0)
+    result = sp.optimize.minimize(fit_model, start, method='L-BFGS-B',
+                                  bounds=[(0.0001, 1)] * p,
+                                  options={'maxiter': 1000})
+    return fit_model(result.x, return_error=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--features', type=int, nargs='+', default=[50, 100, 300, 500])
+    parser.add_argument('--factors', type=int, default=5)
+    parser.add_argument('--reference-max', type=int, default=300,
+                        help='largest number of features fitted by the previous engine')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    report = []
+    for p in args.features:
+        loadings = rng.uniform(0.3, 0.8, size=(p, args.factors))
+        loadings *= rng.random((p, args.factors)) < 0.4
+        x = rng.normal(size=(args.rows, args.factors)) @ loadings.T
+        x += rng.normal(size=(args.rows, p)) * 0.6
+        fa = FactorAnalysis(pd.DataFrame(x, columns=['x%d' % i for i in range(p)]))
+        corr = fa.corr_matrix.copy()
+        start = time.perf_counter()
+        fa.analyse(args.factors)
+        row = {'features': p, 'fit_s': time.perf_counter() - start}
+        if p <= args.reference_max:
+            start = time.perf_counter()
+            expected = reference_loadings(corr, args.factors)
+            row['reference_s'] = time.perf_counter() - start
+            lds = fa.loadings.values
+            row['max_diff'] = np.abs(lds @ lds.T - expected @ expected.T).max()
+        report.append(row)
+    print(pd.DataFrame(report).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
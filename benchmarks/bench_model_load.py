@@ -0,0 +1,120 @@
+"""
+Benchmark of loading a saved RandomForest in several scoring workers
+
+Every worker loads the same model file, either copied into its own memory
+or memory-mapped, scores a batch of rows and reports:
+ - the cold load time (the file pages are dropped from the page cache first
+   where the OS allows it) and the warm load time (loaded again),
+ - its resident memory split into private pages (RssAnon) and file pages
+   shared through the page cache (RssFile), read from /proc on Linux.
+
+Usage:
+    python benchmarks/bench_model_load.py --rows 20000 --trees 100 --workers 8
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from xuerui_stat import RandomForest
+
+
+def memory_status():
+    """
+    resident memory of this process in MB
+    """
+    status = {}
+    if os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                    status[key] = int(value.split()[0]) / 1024
+    return status
+
+def drop_cache(path):
+    """
+    drop the pages of the file from the page cache if possible
+    """
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def worker(path, mmap, rows, barrier, queue):
+    """
+    load the model, score the rows and report the timings and memory
+    """
+    before = memory_status()
+    drop_cache(path)
+    start = time.perf_counter()
+    model = RandomForest.load(path, mmap=mmap)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    RandomForest.load(path, mmap=mmap)
+    warm = time.perf_counter() - start
+    start = time.perf_counter()
+    model.predict(rows)
+    predict = time.perf_counter() - start
+    # every worker holds its model while the memory is measured
+    barrier.wait()
+    after = memory_status()
+    queue.put({'cold_ms': cold * 1e3, 'warm_ms': warm * 1e3, 'predict_ms': predict * 1e3,
+               'rss_mb': after.get('VmRSS', np.nan) - before.get('VmRSS', np.nan),
+               'private_mb': after.get('RssAnon', np.nan) - before.get('RssAnon', np.nan),
+               'shared_mb': after.get('RssFile', np.nan) - before.get('RssFile', np.nan)})
+    barrier.wait()
+
+def run_workers(path, mmap, rows, num_workers):
+    """
+    start the workers at the same time and collect their reports
+    """
+    context = mp.get_context('spawn')
+    barrier = context.Barrier(num_workers)
+    queue = context.Queue()
+    processes = [context.Process(target=worker, args=(path, mmap, rows, barrier, queue))
+                 for i in range(num_workers)]
+    for process in processes:
+        process.start()
+    reports = [queue.get() for process in processes]
+    for process in processes:
+        process.join()
+    return pd.DataFrame(reports)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--features', type=int, default=10)
+    parser.add_argument('--trees', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(args.rows, args.features))
+    data = pd.DataFrame(x, columns=['x%d' % i for i in range(args.features)])
+    data['Cat'] = np.where(x[:, 0] + x[:, 1] + rng.normal(size=args.rows) > 0, 'a', 'b')
+    rf = RandomForest(data, 'Cat', random_state=0)
+    rf.train(num_tree=args.trees, n_jobs=-1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'forest.model')
+        rf.save(path)
+        print('model file: %.1f MB, %d trees, %d nodes' % (
+            os.path.getsize(path) / 2**20, args.trees,
+            sum(tree.node_count for tree in rf._trees)))
+        rows = x[:1000]
+        for mmap in (False, True):
+            reports = run_workers(path, mmap, rows, args.workers)
+            print('\nmmap=%s, %d workers' % (mmap, args.workers))
+            print(reports.describe().loc[['mean', 'min', 'max']].round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
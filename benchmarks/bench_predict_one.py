@@ -0,0 +1,68 @@
+"""
+Latency benchmark of scoring one row per call
+
+For forests of growing tree count and depth, every call scores a single
+row with RandomForest.predict_one (the online fast path) and with
+RandomForest.predict on the same row, and the p50/p99 latency per call is
+reported in microseconds.
+
+Usage:
+    python benchmarks/bench_predict_one.py --trees 10 50 200 --depths 4 8 0
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from xuerui_stat import RandomForest
+
+
+def latency(func, rows, repeat):
+    """
+    p50 and p99 of the time of single calls in microseconds
+    """
+    for row in rows[:10]:
+        func(row)
+    times = np.empty(repeat)
+    for i in range(repeat):
+        row = rows[i % len(rows)]
+        start = time.perf_counter_ns()
+        func(row)
+        times[i] = time.perf_counter_ns() - start
+    return np.percentile(times, [50, 99]) / 1e3
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--features', type=int, default=10)
+    parser.add_argument('--trees', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--depths', type=int, nargs='+', default=[4, 8, 0],
+                        help='maximum depths of the trees, 0 for unlimited')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(args.rows, args.features))
+    data = pd.DataFrame(x, columns=['x%d' % i for i in range(args.features)])
+    data['Cat'] = np.where(x[:, 0] * x[:, 1] + rng.normal(size=args.rows) > 0, 'a', 'b')
+    rows = x[:500]
+
+    report = []
+    for num_tree in args.trees:
+        for max_depth in args.depths:
+            rf = RandomForest(data, 'Cat', random_state=0)
+            rf.train(num_tree=num_tree, max_depth=max_depth, n_jobs=-1)
+            depth = max(int(tree.node_depth().max()) for tree in rf._trees)
+            one = latency(rf.predict_one, rows, args.repeat)
+            batch = latency(rf.predict, rows, args.repeat // 10)
+            report.append({'trees': num_tree, 'depth': depth,
+                           'predict_one_p50': one[0], 'predict_one_p99': one[1],
+                           'predict_p50': batch[0], 'predict_p99': batch[1]})
+    print(pd.DataFrame(report).round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
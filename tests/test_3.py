@@ -0,0 +1,706 @@
+import pytest
+import re
+import numpy as np
+import pandas as pd
+from collections import Counter
+from sklearn.datasets import load_iris
+from xuerui_stat import DecisionTree, PlotTree, RandomForest
+from xuerui_stat.analysis.random_forest.compiled_tree import CompiledTree
+from xuerui_stat.analysis.random_forest.metrics import Metrics
+
+
+def get_test_data():
+    iris = load_iris()
+    df = pd.DataFrame(data=iris.data, columns=iris.feature_names)
+    df['Cat'] = [iris.target_names[i] for i in iris.target]
+    return df
+
+def brute_force_criteria(data, feature):
+    """
+    the split search by scanning every boundary and recounting both halves
+    """
+    def gini(part):
+        count = Counter(part[:, -1])
+        return 1 - sum((c / len(part))**2 for c in count.values())
+    smallest, criteria = 1, 'none'
+    sorted_data = data[np.argsort(data[:, feature])]
+    for i in range(len(data) - 1):
+        if sorted_data[i, feature] != sorted_data[i + 1, feature]:
+            pr = (i + 1) / len(data)
+            f = pr * gini(sorted_data[:i + 1]) + (1 - pr) * gini(sorted_data[i + 1:])
+            if f < smallest:
+                smallest = f
+                criteria = (sorted_data[i, feature] + sorted_data[i + 1, feature]) / 2
+    return criteria, smallest
+
+def set_training(dt, data):
+    """
+    prepare the tree for searching splits in the given rows
+    """
+    x = data[:, :-1].astype(float)
+    y = data[:, -1].astype(int)
+    dt._set_training(x, y, np.ones(len(x)), dt._presort(x))
+
+def brute_force_tree(data, features):
+    """
+    the tree structure given by splitting copies of the data with the brute force scan
+    """
+    if len(set(data[:, -1])) < 2:
+        return None
+    smallest, info = 1, None
+    for feature in range(features):
+        criteria, f = brute_force_criteria(data, feature)
+        if f < smallest:
+            smallest, info = f, (feature, criteria)
+    if info is None:
+        return None
+    left = data[data[:, info[0]] < info[1]]
+    right = data[data[:, info[0]] >= info[1]]
+    return (info, brute_force_tree(left, features), brute_force_tree(right, features))
+
+def tree_structure(tree):
+    """
+    the splits of a tree without the leaves
+    """
+    if not isinstance(tree, dict):
+        return None
+    return (tree['Info'], tree_structure(tree['Left']), tree_structure(tree['Right']))
+
+def flatten(structure):
+    """
+    the splits of a tree structure in preorder
+    """
+    if structure is None:
+        return []
+    return [structure[0]] + flatten(structure[1]) + flatten(structure[2])
+
+def search(tree, row):
+    """
+    the class given by walking a dict tree with a row
+    """
+    while isinstance(tree, dict):
+        feature, criteria = tree['Info']
+        tree = tree['Left'] if row[feature] < criteria else tree['Right']
+    return tree
+
+def test_split_criteria():
+    """
+    test if the split search gives the same splits as the brute force scan
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    for subset in (dt.data, dt.data[50:], dt.data[::7]):
+        set_training(dt, subset)
+        for feature in range(dt.columns_num - 1):
+            criteria, smallest = dt._split_criteria(dt._index[feature], feature)
+            expected = brute_force_criteria(subset, feature)
+            assert criteria == expected[0]
+            assert smallest == pytest.approx(expected[1])
+
+def test_split_none():
+    """
+    test if no split is given when the feature values are all the same
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    data = dt.data.copy()
+    data[:, 0] = 1.0
+    set_training(dt, data)
+    assert dt._split_criteria(dt._index[0], 0) == ('none', 1)
+    assert dt._split_criteria(dt._index[1, :1], 1) == ('none', 1)
+
+def test_split_partition():
+    """
+    test if splitting a node keeps the rows of every feature sorted
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    set_training(dt, dt.data)
+    middle = dt._split(0, len(dt.data), (2, 2.45))
+    assert middle == 50
+    for feature in range(dt.columns_num - 1):
+        for start, end in ((0, middle), (middle, len(dt.data))):
+            rows = dt._index[feature, start:end]
+            assert np.all(np.diff(dt._x[rows, feature]) >= 0)
+            assert np.all((dt._x[rows, 2] < 2.45) == (start == 0))
+
+def test_train():
+    """
+    test if a full tree fits the training data
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train()
+    assert dt.tree['Info'][0] == 2
+    assert dt.test() < 0.01
+    expected = brute_force_tree(dt.data, dt.columns_num - 1)
+    assert tree_structure(dt.tree) == expected
+
+def test_random_forest():
+    """
+    test if a random forest can be trained on the bootstrap weights
+    """
+    rf = RandomForest(get_test_data(), 'Cat')
+    rf.train(num_tree=10)
+    assert len(rf.tree) == 10
+    assert rf.oob_error < 0.2
+    assert rf.test() < 0.05
+
+def test_binning():
+    """
+    test if the binned split search works on the bin edges
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    x = dt.data[:, :-1].astype(float)
+    codes, edges = dt._bin_features(x, 8)
+    assert codes.dtype == np.uint8
+    for feature in range(x.shape[1]):
+        assert len(edges[feature]) <= 7
+        for b, edge in enumerate(edges[feature]):
+            assert np.all((x[:, feature] < edge) == (codes[:, feature] <= b))
+    # each value is a bin when there are few values, so the splits are the same as the exact ones
+    dt.train()
+    exact = tree_structure(dt.tree)
+    dt.train(binning=255)
+    assert tree_structure(dt.tree)[0] == exact[0]
+    assert dt.test() < 0.01
+    dt.train(max_depth=3, binning=16)
+    assert dt.tree['Info'][1] in dt._bin_features(x, 16)[1][dt.tree['Info'][0]]
+    assert dt.test() < 0.1
+    with pytest.raises(ValueError):
+        dt.train(binning=256)
+
+def test_hist_subtraction():
+    """
+    test if the histogram of a child given by subtraction is the same as counting it directly
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    x = dt.data[:, :-1].astype(float)
+    weight = np.arange(len(x)) % 3.0
+    dt._set_training(x, dt.data[:, -1].astype(int), weight, binned=dt._bin_features(x, 16))
+    end = dt._index.shape[1]
+    hist = dt._get_hist(0, end)
+    feature, criteria = dt._split_feature(0, end, hist)
+    middle = dt._split(0, end, (feature, criteria))
+    left, right = dt._child_hists(0, middle, end, hist)
+    assert np.array_equal(left, dt._get_hist(0, middle))
+    assert np.array_equal(right, dt._get_hist(middle, end))
+
+def test_random_forest_binning():
+    """
+    test if a random forest can be trained in the binning mode
+    """
+    rf = RandomForest(get_test_data(), 'Cat')
+    rf.train(num_tree=10, binning=32)
+    assert rf.test() < 0.05
+
+def test_random_forest_jobs():
+    """
+    test if the same random state gives the same forest whatever the number of processes
+    """
+    rf = RandomForest(get_test_data(), 'Cat')
+    rf.train(num_tree=6, random_state=1)
+    trees, oob_error = rf.tree, rf.oob_error
+    rf.train(num_tree=6, n_jobs=3, random_state=1)
+    assert rf.tree == trees
+    assert rf.oob_error == oob_error
+    # the copy sent to the workers carries no rows of the previous training
+    forest = rf._worker_copy()
+    assert forest._inbag is None and forest.oob_decision_function is None
+    assert forest.oob_confusion_matrix is None and rf._inbag is not None
+    rf.train(num_tree=6, n_jobs=2, random_state=1, binning=32)
+    binned = rf.tree
+    rf.train(num_tree=6, random_state=1, binning=32)
+    assert rf.tree == binned
+    rf.train(num_tree=6, random_state=2)
+    assert rf.tree != trees
+
+def test_shared_presort(monkeypatch):
+    """
+    test that trees with every row in the bag leave the presort shared by the forest unchanged
+    """
+    presorts = []
+    presort = RandomForest._presort
+    def capture(self, x):
+        presorts.append(presort(self, x))
+        return presorts[-1]
+    monkeypatch.setattr(RandomForest, '_presort', capture)
+    data = pd.DataFrame({'a': [3.0, 1.0, 2.0], 'b': [1.0, 3.0, 2.0], 'Cat': ['x', 'y', 'x']})
+    rf = RandomForest(data, 'Cat', random_state=0)
+    rf.train(num_tree=50)
+    expected = np.argsort(data[['a', 'b']].values, axis=0, kind='stable').T
+    assert np.array_equal(presorts[0], expected)
+
+def test_random_state():
+    """
+    test if the random state given to the constructor makes the results reproducible
+    """
+    data = get_test_data()
+    forests = [RandomForest(data, 'Cat', random_state=3) for i in range(2)]
+    for rf in forests:
+        rf.train(num_tree=5, max_depth=2)
+    assert forests[0].tree == forests[1].tree
+    assert np.array_equal(forests[0].predict(forests[0].data), forests[1].predict(forests[1].data))
+    # the random state given to train is used instead
+    forests[1].train(num_tree=5, max_depth=2, random_state=4)
+    assert forests[0].tree != forests[1].tree
+    # the constructor's random state is used again when train is called again
+    trees = forests[0].tree
+    forests[0].train(num_tree=5, max_depth=2)
+    assert forests[0].tree == trees
+
+def test_compiled_tree():
+    """
+    test if the array form of a tree gives the same predictions as its dict form
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train(max_depth=4)
+    tree = dt.tree
+    assert CompiledTree.from_dict(tree).to_dict() == tree
+    expected = [search(tree, row) for row in dt.data]
+    assert dt.predict(dt.data).tolist() == expected
+    assert dt.predict(dt.data[0]) == expected[0]
+    # a dict tree can still be set directly
+    dt.tree = {'Info': (0, 5.5), 'Left': 0, 'Right': 1}
+    assert dt.predict(dt.data).tolist() == [int(row[0] >= 5.5) for row in dt.data]
+
+def test_vote():
+    """
+    test if the forest votes for the class chosen by most trees
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=9, max_depth=2)
+    x = rf.data[:, :-1].astype(float)
+    preds = np.array([[search(tree, row) for tree in rf.tree.values()] for row in x])
+    proba = rf.predict_proba(rf.data)
+    assert proba.shape == (len(x), 3)
+    for i in range(3):
+        assert np.allclose(proba[:, i], (preds == i).mean(axis=1))
+    assert np.allclose(rf.predict_proba(rf.data[0]), proba[0])
+    result = rf.predict(rf.data)
+    assert np.all(proba[np.arange(len(x)), result] == proba.max(axis=1))
+
+def test_vote_tie():
+    """
+    test if the ties are broken by one fixed class priority for the same random state,
+    whatever the other rows and the chunks of the prediction
+    """
+    rf = RandomForest(get_test_data(), 'Cat')
+    rf.tree = {0: 0, 1: 1, 2: 2}
+    data = np.tile(rf.data[:1], (200, 1))
+    result = rf.predict(data, random_state=1)
+    assert len(set(result)) == 1
+    assert np.array_equal(rf.predict(data, random_state=1), result)
+    assert {rf.predict(data[:1], random_state=seed)[0] for seed in range(20)} == {0, 1, 2}
+    rf.tree = {0: 0, 1: 1, 2: 2, 3: {'Info': (0, 5.5), 'Left': 2, 'Right': 1}}
+    assert rf.predict(data, random_state=1).tolist() == [2] * 200
+    # two trees tie on the rows where they disagree
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=2, max_depth=1)
+    x = rf.data[:, :-1].astype(float)
+    assert (rf.predict_proba(x).max(axis=1) == 0.5).sum() >= 50
+    expected = rf.predict(x)
+    order = np.random.default_rng(0).permutation(len(x))
+    assert np.array_equal(rf.predict(x[order]), expected[order])
+    assert np.array_equal(np.concatenate(list(rf.predict_iter([x[:77], x[77:]]))), expected)
+    assert [rf.predict_one(row) for row in x] == expected.tolist()
+
+def test_predict_one():
+    """
+    test if the single-row fast path agrees with predict, ties included
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=4, max_depth=1)
+    proba = rf.predict_proba(rf.data)
+    assert (np.sort(proba, axis=1)[:, -2] == proba.max(axis=1)).any()
+    assert [rf.predict_one(row) for row in rf.data] == [rf.predict(row) for row in rf.data]
+    rf.train(num_tree=7)
+    assert [rf.predict_one(row) for row in rf.data] == rf.predict(rf.data).tolist()
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train(max_depth=3)
+    assert [dt.predict_one(row[:-1]) for row in dt.data] == dt.predict(dt.data).tolist()
+    dt.tree = {'Info': (0, 5.5), 'Left': 0, 'Right': 1}
+    assert [dt.predict_one(row) for row in dt.data] == [int(row[0] >= 5.5) for row in dt.data]
+
+def test_oob():
+    """
+    test if the OOB error is given by the votes of the trees not using each row
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=15, max_depth=2)
+    x = rf.data[:, :-1].astype(float)
+    y = rf.data[:, -1].astype(int)
+    votes = np.zeros((len(x), 3))
+    for i, tree in rf.tree.items():
+        for row in rf._oob_rows(i):
+            votes[row, search(tree, x[row])] += 1
+    has_oob = votes.sum(axis=1) > 0
+    assert np.allclose(rf.oob_decision_function[has_oob], votes[has_oob] / votes[has_oob].sum(axis=1)[:, None])
+    assert np.all(np.isnan(rf.oob_decision_function[~has_oob]))
+    mat = rf.oob_confusion_matrix
+    assert mat.values.sum() == has_oob.sum()
+    assert list(mat.columns) == rf.categories
+    # rows without ties are counted as the majority of the OOB votes
+    no_tie = has_oob & ((votes == votes.max(axis=1)[:, None]).sum(axis=1) == 1)
+    wrong = (np.argmax(votes, axis=1) != y)[no_tie].sum()
+    total_wrong = has_oob.sum() - np.trace(mat.values)
+    assert wrong <= total_wrong <= wrong + (has_oob & ~no_tie).sum()
+    assert rf.oob_error == pytest.approx(total_wrong / has_oob.sum())
+
+def test_preprocessing():
+    """
+    test if the categories are numbered in the order they appear
+    """
+    df = get_test_data()
+    df = df[['Cat'] + list(df.columns[:-1])].iloc[::-1]
+    dt = DecisionTree(df, 'Cat')
+    assert dt.categories == ['virginica', 'versicolor', 'setosa']
+    assert list(dt.features) == list(df.columns[1:]) + ['Cat']
+    assert [dt.categories[i] for i in dt.y] == list(df['Cat'])
+    assert dt.x.dtype == np.float64 and dt.x.flags.c_contiguous
+    assert np.array_equal(dt.x, df.iloc[:, 1:].values)
+    assert np.array_equal(dt.data[:, -1], dt.y)
+    df.iloc[3, 0] = None
+    with pytest.raises(ValueError):
+        DecisionTree(df, 'Cat')
+
+def test_dtype():
+    """
+    test if a float32 or column-major feature matrix gives the same tree
+    """
+    df = get_test_data()
+    dt = DecisionTree(df, 'Cat')
+    dt.train()
+    expected = tree_structure(dt.tree)
+    assert dt.y.dtype == np.uint8
+    usage = dt.memory_usage()
+    assert usage['x'] == 150 * 4 * 8 and usage['total'] == usage['x'] + usage['y']
+    dt = DecisionTree(df, 'Cat', order='F')
+    assert dt.x.flags.f_contiguous
+    dt.train()
+    assert tree_structure(dt.tree) == expected
+    dt = DecisionTree(df, 'Cat', dtype=np.float32)
+    assert dt.memory_usage()['x'] == 150 * 4 * 4
+    dt.train()
+    # the splits are the same though the values are rounded
+    assert [info[0] for info in flatten(tree_structure(dt.tree))] == \
+        [info[0] for info in flatten(expected)]
+    assert dt.test() < 0.01
+    rf = RandomForest(df, 'Cat', random_state=0, dtype=np.float32, order='F')
+    rf.train(num_tree=4, n_jobs=2)
+    trees = rf.tree
+    rf.train(num_tree=4)
+    assert rf.tree == trees
+    with pytest.raises(TypeError):
+        DecisionTree(df, 'Cat', dtype=int)
+
+def test_save_load(tmp_path):
+    """
+    test if a saved model gives the same predictions after being loaded
+    """
+    data = get_test_data()
+    dt = DecisionTree(data, 'Cat', random_state=5)
+    dt.train(max_depth=3)
+    path = str(tmp_path / 'tree.model')
+    dt.save(path)
+    model = DecisionTree.load(path)
+    assert model.tree == dt.tree
+    assert model.categories == dt.categories
+    assert list(model.features) == list(dt.features)
+    assert model.random_state == 5
+    assert np.array_equal(model.predict(dt.data), dt.predict(dt.data))
+    with pytest.raises(TypeError):
+        RandomForest.load(path)
+
+    rf = RandomForest(data, 'Cat')
+    with pytest.raises(ValueError):
+        rf.save(path)
+    rf.train(num_tree=7)
+    rf.save(path)
+    model = RandomForest.load(path)
+    assert model.tree == rf.tree
+    assert model.oob_error == rf.oob_error
+    assert np.array_equal(model.predict(rf.data), rf.predict(rf.data))
+    assert np.array_equal(model.predict_proba(rf.data), rf.predict_proba(rf.data))
+    with open(path, 'rb') as f:
+        assert f.read(8) == b'XRSTATMD'
+    with open(path, 'r+b') as f:
+        f.write(b'NOTMODEL')
+    with pytest.raises(ValueError):
+        RandomForest.load(path)
+    # trees set directly have no training results to save
+    rf = RandomForest(data, 'Cat')
+    split = {'Info': (2, 2.5), 'Left': 0, 'Right': 1}
+    rf.tree = {0: split, 1: 2, 2: split}
+    rf.save(path)
+    model = RandomForest.load(path)
+    assert model.tree == rf.tree
+    assert model.oob_error is None and model.subf_num is None
+    assert np.array_equal(model.predict(rf.data), rf.predict(rf.data))
+
+def test_load_mmap(tmp_path):
+    """
+    test if a memory-mapped model predicts from the mapped arrays without copying them
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=5, max_depth=3)
+    path = str(tmp_path / 'forest.model')
+    rf.save(path)
+    model = RandomForest.load(path, mmap=True)
+    arrays = [getattr(tree, name) for tree in model._trees for name in tree.ARRAYS]
+    assert all(not array.flags.writeable and not array.flags.owndata for array in arrays)
+    assert model.tree == rf.tree
+    assert np.array_equal(model.predict(rf.data), rf.predict(rf.data))
+    with pytest.raises(ValueError):
+        model.train(num_tree=2)
+
+def test_predict_file(tmp_path):
+    """
+    test if chunked prediction of a file or DataFrames matches predicting all rows at once
+    """
+    df = get_test_data()
+    rf = RandomForest(df, 'Cat', random_state=0)
+    rf.train(num_tree=5, max_depth=3)
+    expected = rf.predict(rf.data)
+    path = str(tmp_path / 'iris.csv')
+    df.to_csv(path, index=False)
+    result = list(rf.predict_file(path, chunksize=40))
+    assert [len(r) for r in result] == [40, 40, 40, 30]
+    assert np.array_equal(np.concatenate(result), expected)
+    # columns in another order, with or without the category column
+    shuffled = df[['Cat'] + list(df.columns[::-1][1:])]
+    chunks = [shuffled[:70], shuffled[70:].drop(columns='Cat')]
+    assert np.array_equal(np.concatenate(list(rf.predict_iter(chunks))), expected)
+    pairs = list(rf.predict_iter([shuffled[:70], shuffled[70:]], labels=True))
+    assert np.array_equal(np.concatenate([y for _, y in pairs]), rf.y)
+    output = str(tmp_path / 'pred.csv')
+    assert rf.predict_file(path, chunksize=64, output=output) == 150
+    names = pd.read_csv(output)['Cat']
+    assert names.tolist() == [rf.categories[i] for i in expected]
+    assert rf.test(shuffled) == rf.test()
+    with pytest.raises(ValueError):
+        list(rf.predict_iter([df.replace('setosa', 'unknown')], labels=True))
+    # a DataFrame missing a feature name is not read by position
+    renamed = shuffled.rename(columns={df.columns[1]: 'width'})
+    with pytest.raises(ValueError, match=re.escape(df.columns[1])):
+        rf.predict(renamed)
+    assert np.array_equal(rf.predict(df.values[:, :-1]), expected)
+
+def test_predict_parquet(tmp_path):
+    """
+    test if a Parquet file is scored in chunks like the CSV file
+    """
+    pytest.importorskip('pyarrow')
+    df = get_test_data()
+    dt = DecisionTree(df, 'Cat')
+    dt.train(max_depth=3)
+    path = str(tmp_path / 'iris.parquet')
+    df.to_parquet(path)
+    result = list(dt.predict_file(path, chunksize=100))
+    assert np.array_equal(np.concatenate(result), dt.predict(dt.data))
+
+def test_predict_threads():
+    """
+    test if splitting the rows across threads gives the same predictions
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=5, max_depth=3)
+    data = np.repeat(rf.data, 4, axis=0)
+    expected = rf.predict(data)
+    rf.PARALLEL_MIN_ROWS = 100
+    assert np.array_equal(rf.predict(data, n_jobs=4), expected)
+    # n_jobs is the second argument as in DecisionTree.predict, random_state only by name
+    assert np.array_equal(rf.predict(data, 4), expected)
+    with pytest.raises(TypeError):
+        rf.predict(data, 4, 1)
+    assert np.array_equal(rf.predict_proba(data, n_jobs=-1), rf.predict_proba(data))
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train()
+    dt.PARALLEL_MIN_ROWS = 100
+    assert np.array_equal(dt.predict(data, n_jobs=3), dt.predict(data))
+
+def test_metrics(tmp_path):
+    """
+    test the streamed metrics against per-row counting
+    """
+    df = get_test_data()
+    rf = RandomForest(df, 'Cat', random_state=0)
+    rf.train(num_tree=5, max_depth=2)
+    error = rf.test()
+    pred, proba = rf.predict(rf.data), rf.predict_proba(rf.data)
+    mat = np.zeros((3, 3))
+    for i, j in zip(rf.y, pred):
+        mat[i, j] += 1
+    assert np.array_equal(rf.confusion_matrix.to_numpy(), mat)
+    assert error == pytest.approx(1 - np.trace(mat) / 150)
+    metrics = rf.metrics
+    assert np.allclose(metrics.precision, np.diag(mat) / mat.sum(axis=0))
+    assert np.allclose(metrics.recall, np.diag(mat) / mat.sum(axis=1))
+    assert np.allclose(metrics.f1, 2 * np.diag(mat) / (mat.sum(axis=0) + mat.sum(axis=1)))
+    p = np.clip(proba[np.arange(150), rf.y], Metrics.EPS, 1)
+    assert metrics.log_loss == pytest.approx(-np.log(p).mean())
+    assert metrics.report()['support'].tolist() == [50, 50, 50]
+    # accumulated over chunks of a file
+    path = str(tmp_path / 'iris.csv')
+    df.to_csv(path, index=False)
+    assert rf.test_file(path, chunksize=32) == pytest.approx(error)
+    assert np.array_equal(rf.metrics.count, metrics.count)
+    assert rf.metrics.log_loss == pytest.approx(metrics.log_loss)
+    dt = DecisionTree(df, 'Cat')
+    dt.train(max_depth=2)
+    assert dt.test_iter([df[:50], df[50:]]) == dt.test()
+    assert np.isnan(dt.metrics.log_loss)
+
+def test_tree_limits():
+    """
+    test if the pre-pruning limits hold on the grown trees
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train()
+    full, full_count = dt.tree, dt._tree.node_count
+    dt.train(min_samples_leaf=5)
+    leaves = dt._tree.apply(dt.x)
+    assert np.bincount(leaves)[np.unique(leaves)].min() >= 5
+    dt.train(min_samples_split=20)
+    tree = dt._tree
+    # count the rows passing through every node
+    reached = np.zeros(tree.node_count, dtype=int)
+    for row in dt.x:
+        node = 0
+        while True:
+            reached[node] += 1
+            if tree.left[node] < 0:
+                break
+            f = tree.feature[node]
+            node = tree.left[node] if row[f] < tree.threshold[node] else tree.right[node]
+    assert reached[tree.left >= 0].min() >= 20
+    # best-first growth stops at the leaf budget, and without a binding budget
+    # it grows the same tree as depth-first growth
+    for max_leaf_nodes in (2, 3, 5):
+        dt.train(max_leaf_nodes=max_leaf_nodes)
+        assert np.count_nonzero(dt._tree.left < 0) == max_leaf_nodes
+    dt.train(max_leaf_nodes=1000)
+    assert dt.tree == full
+    dt.train(min_impurity_decrease=0.01)
+    assert dt._tree.node_count < full_count
+    dt.train(min_impurity_decrease=1)
+    assert dt._tree.node_count == 1
+    with pytest.raises(ValueError):
+        dt.train(max_leaf_nodes=1)
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=5, max_leaf_nodes=4, min_samples_leaf=3)
+    assert all(np.count_nonzero(tree.left < 0) <= 4 for tree in rf._trees)
+
+def test_growth_order():
+    """
+    test if breadth-first growth builds the same trees as depth-first growth,
+    and if a chain deeper than the recursion limit can be grown
+    """
+    dt = DecisionTree(get_test_data(), 'Cat')
+    for kwargs in ({}, {'max_depth': 3}, {'min_samples_leaf': 5}, {'binning': 8},
+                   {'binning': 16, 'min_impurity_decrease': 0.01}):
+        dt.train(**kwargs)
+        expected = dt.tree
+        dt.train(growth='breadth', **kwargs)
+        assert dt.tree == expected
+        depth = dt._tree.node_depth()
+        # nodes are numbered level by level
+        assert np.all(np.diff(depth) >= 0)
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=5, growth='breadth')
+    assert rf.oob_error < 0.2
+    # only the (node, feature) pairs drawn as candidates are evaluated
+    pairs, candidates = [], []
+    level_criteria, candidate_features = rf._level_criteria, rf._candidate_features
+    def count_pairs(pos, seg, offsets, count, feature):
+        pairs.append(len(offsets))
+        return level_criteria(pos, seg, offsets, count, feature)
+    def count_candidates():
+        features = candidate_features()
+        candidates.append(len(features))
+        return features
+    rf._level_criteria, rf._candidate_features = count_pairs, count_candidates
+    rf.train(num_tree=5, growth='breadth')
+    assert rf.subf_num < 4 and sum(pairs) == sum(candidates) > 0
+    # alternating classes make every split peel off a single row
+    n = 1200
+    chain = pd.DataFrame({'a': np.arange(n, dtype=float), 'Cat': np.arange(n) % 2})
+    dt = DecisionTree(chain, 'Cat')
+    for growth in ('depth', 'breadth'):
+        dt.train(growth=growth)
+        assert dt._tree.node_depth().max() > 1000
+        assert dt.test() == 0
+        if growth == 'depth':
+            compiled = dt._tree
+        # the dict form is converted both ways without recursion, numbering the nodes in preorder
+        dt.tree = dt.tree
+        for name in CompiledTree.ARRAYS:
+            assert np.array_equal(getattr(dt._tree, name), getattr(compiled, name))
+        assert PlotTree(dt)._PlotTree__get_tree_depth(dt.tree) == n
+    # every feature holds a single value while the classes are mixed
+    flat = pd.DataFrame({'a': [1.] * 6, 'b': [2.] * 6, 'Cat': list('xyxyxy')})
+    dt = DecisionTree(flat, 'Cat')
+    for kwargs in ({}, {'binning': 8}):
+        for growth in ('depth', 'breadth'):
+            dt.train(growth=growth, **kwargs)
+            assert dt._tree.node_count == 1
+        dt.train(max_leaf_nodes=4, **kwargs)
+        assert dt._tree.node_count == 1
+
+def test_prune(tmp_path):
+    """
+    test the cost-complexity pruning path against scikit-learn and the pruned trees
+    """
+    from sklearn.tree import DecisionTreeClassifier
+    iris = load_iris()
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train()
+    full = dt.tree
+    path = dt.cost_complexity_path()
+    expected = DecisionTreeClassifier(random_state=0).cost_complexity_pruning_path(
+        iris.data, iris.target)
+    assert np.allclose(path['alpha'], expected.ccp_alphas)
+    assert np.allclose(path['impurity'], expected.impurities)
+    for alpha, nodes in zip(path['alpha'][1:], path['nodes'][1:]):
+        summary = dt.prune(alpha)
+        assert summary.loc['before', 'nodes'] == path['nodes'][0]
+        assert summary.loc['after', 'nodes'] == nodes == dt._tree.node_count
+        assert summary.loc['after', 'path_length'] <= summary.loc['before', 'path_length']
+    assert dt._tree.node_count == 1
+    dt.prune(0)
+    assert dt.tree == full
+    # the path is kept after saving, and recomputed after training again
+    path_name = str(tmp_path / 'tree.model')
+    dt.save(path_name)
+    model = DecisionTree.load(path_name)
+    assert model.cost_complexity_path().equals(path)
+    dt.train(max_depth=2)
+    assert len(dt.cost_complexity_path()) < len(path)
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=5)
+    summary = rf.prune(0.02)
+    assert summary.loc['after', 'nodes'] < summary.loc['before', 'nodes']
+    assert summary.loc['after', 'nodes'] == sum(tree.node_count for tree in rf._trees)
+    assert len(rf.cost_complexity_path()) == 5
+
+def test_feature_importance(tmp_path):
+    """
+    test the impurity-decrease importances against the node counts, and the OOB permutation importance
+    """
+    rf = RandomForest(get_test_data(), 'Cat', random_state=0)
+    rf.train(num_tree=10)
+    importance = rf.feature_importances
+    assert list(importance.index) == list(rf.features[:-1])
+    assert importance.sum() == pytest.approx(1)
+    # the decreases summed while splitting equal the decreases recomputed from the node counts
+    for tree in rf._trees:
+        assert np.allclose(tree.prune([]).importance, tree.importance)
+    path = str(tmp_path / 'forest.model')
+    rf.save(path)
+    assert RandomForest.load(path).feature_importances.equals(importance)
+    permutation = rf.permutation_importance(n_repeats=3, random_state=1)
+    assert permutation.equals(rf.permutation_importance(n_repeats=3, n_jobs=3, random_state=1))
+    assert permutation['importance'].iloc[2:].min() > permutation['importance'].iloc[:2].max()
+    dt = DecisionTree(get_test_data(), 'Cat')
+    dt.train(growth='breadth')
+    expected = dt.feature_importances
+    dt.train()
+    assert np.allclose(dt.feature_importances, expected)
+    dt.tree = {'Info': (0, 5.5), 'Left': 0, 'Right': 1}
+    assert dt.feature_importances is None
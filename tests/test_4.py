@@ -0,0 +1,169 @@
+import pytest
+import numpy as np
+import pandas as pd
+import scipy as sp
+from xuerui_stat import FactorAnalysis
+from xuerui_stat.datatool import basic_func as bf
+
+
+def get_factor_data(n=500, p=12, k=3, seed=0):
+    """
+    data generated by k factors, every feature loading on one of them
+    """
+    rng = np.random.default_rng(seed)
+    loadings = np.zeros((p, k))
+    loadings[np.arange(p), np.arange(p) % k] = rng.uniform(0.5, 0.9, p)
+    x = rng.normal(size=(n, k)) @ loadings.T
+    x += rng.normal(size=(n, p)) * np.sqrt(1 - (loadings**2).sum(axis=1))
+    return pd.DataFrame(x, columns=['x%d' % i for i in range(p)])
+
+def test_fit_gradient():
+    """
+    test the analytic gradient of the sum squared residuals against finite differences
+    """
+    corr = FactorAnalysis(get_factor_data()).corr_matrix
+    rng = np.random.default_rng(1)
+    for k in (1, 3, 5):
+        def error(psi):
+            return FactorAnalysis._fit_model(psi, corr.copy(), k)[0]
+        def gradient(psi):
+            return FactorAnalysis._fit_model(psi, corr.copy(), k)[1]
+        psi = rng.uniform(0.2, 0.8, len(corr))
+        assert sp.optimize.check_grad(error, gradient, psi) < 1e-5
+
+def test_loadings():
+    """
+    test the loadings against the fit by finite differences and the generating structure
+    """
+    data = get_factor_data()
+    fa = FactorAnalysis(data)
+    corr = fa.corr_matrix.copy()
+    fa.analyse(3)
+    lds = fa.loadings.values
+    assert list(fa.loadings.index) == list(data.columns)
+    # the fit without the gradient
+    p = len(corr)
+    result = sp.optimize.minimize(
+        lambda psi: FactorAnalysis._fit_model(psi, corr.copy(), 3)[0],
+        1 - abs(corr - np.eye(p)).max(axis=0), method='L-BFGS-B',
+        bounds=[(0.0001, 1)] * p, options={'maxiter': 1000})
+    expected = FactorAnalysis._fit_model(result.x, corr.copy(), 3, return_error=False)
+    assert np.allclose(lds @ lds.T, expected @ expected.T, atol=1e-4)
+    # every feature loads on its own factor
+    assert (np.abs(lds).max(axis=1) > 0.4).all()
+    off = ~np.eye(p, dtype=bool)
+    assert np.abs((lds @ lds.T - corr)[off]).max() < 0.1
+
+def test_fit_reentrant():
+    """
+    test that fits leave the shared correlation matrix unchanged and can run in threads
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    fa = FactorAnalysis(get_factor_data(p=20))
+    corr = fa.corr_matrix.copy()
+    assert not fa.corr_matrix.flags.writeable
+    serial = [fa._compute_loadings(fa.corr_matrix, k) for k in range(1, 6)]
+    assert np.array_equal(fa.corr_matrix, corr)
+    with ThreadPoolExecutor(4) as executor:
+        threaded = list(executor.map(lambda k: fa._compute_loadings(fa.corr_matrix, k), range(1, 6)))
+    for a, b in zip(serial, threaded):
+        assert a.equals(b)
+    psi = np.full(20, 0.5)
+    buffer = np.empty((20, 20))
+    assert np.allclose(fa._fit_model(psi, corr, 3, buffer=buffer)[1], fa._fit_model(psi, corr, 3)[1])
+    assert np.array_equal(corr, fa.corr_matrix)
+    # a call with a given buffer allocates nothing of size p*p, whatever its order
+    import tracemalloc
+    p = 200
+    corr = np.corrcoef(np.random.default_rng(0).normal(size=(400, p)).T)
+    for order in 'FC':
+        buffer = np.empty((p, p), order=order)
+        FactorAnalysis._fit_model(np.full(p, 0.5), corr, 5, buffer=buffer)
+        tracemalloc.start()
+        FactorAnalysis._fit_model(np.full(p, 0.5), corr, 5, buffer=buffer)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert peak < p * p * 8 / 2
+
+def test_analyse_range():
+    """
+    test the sweep over numbers of factors against single fits
+    """
+    fa = FactorAnalysis(get_factor_data())
+    table = fa.analyse_range([4, 1, 2, 3, 2])
+    assert list(table.index) == [1, 2, 3, 4]
+    assert np.allclose(table['eigenvalue'], np.linalg.eigvalsh(fa.corr_matrix)[::-1][:4])
+    assert table['error'].is_monotonic_decreasing
+    assert table.loc[3, 'rmsr'] < 0.05 < table.loc[2, 'rmsr']
+    for k in table.index:
+        fa.analyse(k)
+        lds = table.loc[k, 'loadings']
+        assert lds.shape == (12, k)
+        assert np.allclose(lds.values @ lds.values.T, fa.loadings.values @ fa.loadings.values.T, atol=1e-4)
+        assert np.allclose(table.loc[k, 'communalities'], fa.get_communalities()['Communalities'], atol=1e-4)
+    threaded = fa.analyse_range(range(1, 5), n_jobs=2)
+    assert np.allclose(threaded['error'], table['error'])
+    for ks in ([], [0, 3], [3, 12]):
+        with pytest.raises(ValueError):
+            fa.analyse_range(ks)
+    rotated = fa.analyse_range([3], rotation=True)
+    assert np.allclose(rotated.loc[3, 'communalities'], table.loc[3, 'communalities'])
+
+def test_corr_stream(tmp_path):
+    """
+    test the correlation matrix merged from chunks, and the model built from it
+    """
+    data = get_factor_data()
+    data += np.arange(12) * 1000
+    path = str(tmp_path / 'data.csv')
+    data.to_csv(path, index=False)
+    acc = bf.corr_stream(pd.read_csv(path, chunksize=64))
+    assert acc.n == len(data)
+    assert list(acc.columns) == list(data.columns)
+    assert np.allclose(acc.corr, bf.corr_mtx(data))
+    assert np.allclose(acc.cov, np.cov(data.values.T))
+    merged = bf.corr_stream([data.values[:7]]).merge(bf.corr_stream([data.values[7:300], data.values[300:]]))
+    assert np.allclose(merged.corr, acc.corr)
+    fa = FactorAnalysis.from_corr(acc.corr, acc.n, acc.columns)
+    expected = FactorAnalysis(data)
+    table = fa.analyse_range(range(1, 5))
+    assert np.allclose(table['error'], expected.analyse_range(range(1, 5))['error'])
+    assert table.loc[3, 'chi2'] < 2 * table.loc[3, 'dof'] < table.loc[2, 'chi2']
+    fa.analyse(3)
+    assert list(fa.loadings.index) == list(data.columns)
+    assert fa.get_score() is None
+    unnamed = FactorAnalysis.from_corr(pd.DataFrame(acc.corr), acc.n)
+    unnamed.analyse(2)
+    assert list(unnamed.get_communalities_uniqueness().index) == list(range(12))
+    assert FactorAnalysis.from_corr(acc.corr, acc.n).columns[0] == 'Var1'
+
+def test_central_standard():
+    """
+    test the standardisation into a given buffer, in place and in float32, and the scores reusing it
+    """
+    data = get_factor_data() * 3 + 10
+    z = bf.central_standard(data)
+    assert np.allclose(z, (data - data.mean()) / data.std())
+    out = np.empty(data.shape)
+    assert bf.central_standard(data, out=out) is out
+    assert np.array_equal(out, z)
+    x = data.values.astype(np.float32)
+    assert bf.central_standard(x, out=x) is x
+    assert np.allclose(x, z, atol=1e-5)
+    assert bf.central_standard(data, dtype=np.float32).dtype == np.float32
+    fa = FactorAnalysis(data)
+    fa.analyse(3)
+    scores = fa.get_score()
+    # Bartlett scores by the dense formula
+    lds = fa.loadings.values
+    p = np.diag(1 / fa.get_uniqueness().values[:, 0])
+    expected = np.linalg.inv(lds.T @ p @ lds) @ lds.T @ p @ z.T
+    assert np.allclose(scores.values, expected.T)
+    fa32 = FactorAnalysis(data, dtype=np.float32)
+    assert fa32._standardised.dtype == np.float32
+    # the correlation matrix keeps float64 precision
+    assert np.array_equal(np.diag(fa32.corr_matrix), np.ones(12))
+    assert np.allclose(fa32.corr_matrix, np.corrcoef(data.values.T), atol=1e-9)
+    assert np.allclose(bf.cross_product(x, block=100), x.astype(np.float64).T @ x)
+    fa32.analyse(3)
+    assert np.allclose(fa32.get_score(), scores, atol=1e-4)
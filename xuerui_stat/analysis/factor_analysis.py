@@ -1,7 +1,9 @@
+import os
 import numpy as np
 import pandas as pd
 import scipy as sp
 import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
 from ..visualisation import visual_data as vd
 from ..datatool import basic_func as bf
 
@@ -11,22 +13,67 @@ class FactorAnalysis():
     Rotate Loadings
 
     Note:
-    1. Input data as a pandas DataFrame
+    1. Input data as a pandas DataFrame,
+       or use from_corr(corr_matrix,n) for data read in chunks
     2. Use analyse(k,rotation) to get loadings
         - k: Number of factors
         - rotation: True/False
+    3. Use analyse_range(ks,rotation,n_jobs) to compare numbers of factors
     """
 
-    def __init__(self, data):
+    def __init__(self, data, dtype=None):
+        """
+        - data: n*p DataFrame
+        - dtype: Type of the standardised data kept for get_score(),
+                e.g. np.float32 to halve its memory, float64 if None(default);
+                the correlation matrix is always accumulated in float64
+        """
         self.data = data
+        # Standardised once, for the correlation matrix and get_score()
+        self._standardised = bf.central_standard(data, dtype=dtype)
+        corr_matrix = bf.cross_to_corr(bf.cross_product(self._standardised))
+        self._set_corr(corr_matrix, data.columns, len(data))
+
+    @classmethod
+    def from_corr(cls, corr_matrix, n, columns=None):
+        """Build the model from a correlation matrix instead of the data
+        ---------
+        Variables:
+        - corr_matrix: Correlation matrix of features, e.g. the .corr of
+                bf.corr_stream() on chunks of a large table,
+                p*p np.array or DataFrame
+        - n: Number of observations behind corr_matrix,
+                int value
+        - columns: Names of features, by default the columns of a
+                DataFrame corr_matrix, else Var1...Varp
+        ---------
+        The data is not kept, so get_score() returns None
+        """
+        if columns is None and isinstance(corr_matrix, pd.DataFrame):
+            columns = corr_matrix.columns
+        corr_matrix = np.array(corr_matrix, dtype=float)
+        if columns is None:
+            columns = ['Var{}'.format(i) for i in range(1, len(corr_matrix) + 1)]
+        fa = cls.__new__(cls)
+        fa.data = None
+        fa._set_corr(corr_matrix, pd.Index(columns), n)
+        return fa
+
+    def _set_corr(self, corr_matrix, columns, n):
+        self.columns = columns
+        self.n = n
         self.loadings = None
         self.rotation_matrix = None
-        self.corr_matrix=bf.corr_mtx(data)
-        vd.plot_eigenvalues(self.corr_matrix)
+        self.corr_matrix = corr_matrix
+        # Shared by all fits, which only read it
+        self.corr_matrix.setflags(write=False)
+        # Sorted from the largest, computed once for the plot and analyse_range()
+        self.eigenvalues = np.linalg.eigvalsh(self.corr_matrix)[::-1]
+        vd.plot_eigenvalues(self.eigenvalues)
 
     @staticmethod
-    def _fit_model(psi, corr_matrix, n_factors, return_error=True):
-        """Calculate the sum squared residuals
+    def _fit_model(psi, corr_matrix, n_factors, return_error=True, buffer=None):
+        """Calculate the sum squared residuals and its gradient
         ---------
         Variables:
         - psi: Corvariance of epsilons, p*p diagonal matrix,
@@ -35,62 +82,99 @@ class FactorAnalysis():
                 p*p np.array
         - n_factors: Number of factors,
                 int value
-        - return_error: If True,return error, else return loadings
+        - return_error: If True,return error and gradient, else return loadings
                 bool TRUE(default) or FALSE
+        - buffer: Scratch space for Corr-Psi, corr_matrix is never changed,
+                p*p np.array, allocated if None(default)
         ---------
         Returns:
         - error: float scalar
                 residuals=corr_matrix-loadings*loadings^T
                 sum squared residuals
+        - gradient: length-p np.array
+                d(error)/d(psi_j) = -2*residuals_jj
         - loadings: p*n_factor np.array
                 Loadings * Loadings^T = Corr-Psi
         """
-        # Calculate Corr-Psi
-        np.fill_diagonal(corr_matrix, 1 - psi)
-        # Calculate the eigensystem
-        values, vectors = np.linalg.eig(corr_matrix)
+        p = len(corr_matrix)
+        if buffer is None:
+            buffer = np.empty((p, p), order='F')
+        # Calculate Corr-Psi in the buffer
+        np.copyto(buffer, corr_matrix)
+        np.fill_diagonal(buffer, 1 - psi)
+        # The buffer is symmetric, so its transpose is the same matrix:
+        # vdot reads a C-ordered view and eigh a Fortran-ordered one, neither copies
+        c_view = buffer if buffer.flags.c_contiguous else buffer.T
+        f_view = buffer if buffer.flags.f_contiguous else buffer.T
+        # ||Corr-Psi||^2, before the eigensolver overwrites the buffer
+        total = np.vdot(c_view, c_view)
+        # Calculate the largest n eigenvalues of the symmetric matrix
+        values, vectors = sp.linalg.eigh(f_view, overwrite_a=True, check_finite=False,
+                                         subset_by_index=[p - n_factors, p - 1])
         # Sort the values from the largest
-        # Keep n factors
-        sorted_indices = np.argsort(values)[::-1][:n_factors]
-        values = values[sorted_indices]
-        vectors = vectors[:, sorted_indices]
+        values = np.maximum(values[::-1], 0)
+        vectors = vectors[:, ::-1]
         # Calculate Loadings
-        loadings = np.dot(vectors, np.diag(np.sqrt(np.maximum(values, 0))))
+        loadings = vectors * np.sqrt(values)
         if return_error:
-            # Calculate the error
-            residuals = corr_matrix - np.dot(loadings, loadings.T)
-            error = np.sum(residuals**2)
-            return error
+            # The residuals keep the other eigenvalues,
+            # so the error is ||Corr-Psi||^2 - sum(values^2)
+            error = total - np.sum(values**2)
+            # Diagonal of the residuals
+            residuals = (1 - psi) - np.sum(loadings**2, axis=1)
+            return error, -2 * residuals
         else:
             return loadings
 
-    def _compute_loadings(self,corr_matrix, n_factors):
-        """Find the loadings that minimize the error
+    def _optimise(self, corr_matrix, n_factors, start=None):
+        """Find the psi that minimizes the error
         ---------
         Variables:
-        - data: matrix of the features
-                n*p DataFrame
+        - corr_matrix: Correlation matrix of features,
+                p*p np.array
         - n_factors: Number of factors,
                 int value
+        - start: Initial psi, e.g. the solution of a neighbouring n_factors,
+                length-p np.array or None(default)
         ---------
         Returns:
-        - loadings: p*n_factor DataFrame
+        - result: OptimizeResult of scipy, psi in result.x
+        - loadings: p*n_factor np.array
         """
         p = len(corr_matrix)
-        start = 1 - abs(corr_matrix - np.eye(p)).max(axis=0)
+        if start is None:
+            start = 1 - abs(corr_matrix - np.eye(p)).max(axis=0)
         bounds = [(0.0001, 1) for i in range(p)]
+        # Scratch space of this fit only, so fits can run concurrently
+        buffer = np.empty((p, p), order='F')
         objective = self._fit_model
         result = sp.optimize.minimize(objective, start,
                                       method='L-BFGS-B',
+                                      jac=True,
                                       bounds=bounds,
                                       options={'maxiter': 1000},
-                                      args=(corr_matrix, n_factors))
+                                      args=(corr_matrix, n_factors, True, buffer))
+        loadings = self._fit_model(
+            result.x, corr_matrix, n_factors, return_error=False, buffer=buffer)
+        return result, loadings
+
+    def _compute_loadings(self,corr_matrix, n_factors):
+        """Find the loadings that minimize the error
+        ---------
+        Variables:
+        - data: matrix of the features
+                n*p DataFrame
+        - n_factors: Number of factors,
+                int value
+        ---------
+        Returns:
+        - loadings: p*n_factor DataFrame
+        """
+        result, loadings = self._optimise(corr_matrix, n_factors)
         # get factor column names
         columns = ['Factor{}'.format(i) for i in range(1, n_factors + 1)]
-        loadings = self._fit_model(
-            result.x, corr_matrix, n_factors, return_error=False)
         loadings = pd.DataFrame(loadings,
-                                index=self.data.columns.values,
+                                index=self.columns.values,
                                 columns=columns)
         return loadings
 
@@ -157,6 +241,97 @@ class FactorAnalysis():
 
         self.loadings = loadings
 
+    def _fit_chain(self, ks, rotation):
+        """Fit the sorted ks one after another,
+        each starting from the psi of the previous one"""
+        p = len(self.corr_matrix)
+        off_diagonal = ~np.eye(p, dtype=bool)
+        # ln|Corr| from the eigenvalues, nan if Corr is singular
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logdet = np.sum(np.log(self.eigenvalues))
+        rows = []
+        start = None
+        for k in ks:
+            result, lds = self._optimise(self.corr_matrix, k, start)
+            start = result.x
+            residuals = self.corr_matrix - np.dot(lds, lds.T)
+            communalities = (lds ** 2).sum(axis=1)
+            # Discrepancy of the implied correlation LL^T+(I-diag(LL^T))
+            sigma = np.dot(lds, lds.T)
+            np.fill_diagonal(sigma, 1)
+            sign, sigma_logdet = np.linalg.slogdet(sigma)
+            if sign > 0:
+                discrepancy = (sigma_logdet - logdet - p
+                               + np.trace(np.linalg.solve(sigma, self.corr_matrix)))
+            else:
+                discrepancy = np.nan
+            loadings = pd.DataFrame(
+                lds, index=self.columns.values,
+                columns=['Factor{}'.format(i) for i in range(1, k + 1)])
+            if rotation:
+                loadings = self._rotation(loadings)[0]
+            rows.append({
+                'n_factors': k,
+                'error': result.fun,
+                'rmsr': np.sqrt(np.mean(residuals[off_diagonal]**2)),
+                'eigenvalue': self.eigenvalues[k - 1],
+                'pc_variance': self.eigenvalues[:k].sum() / p,
+                'explained': communalities.sum() / p,
+                'chi2': (self.n - 1 - (2 * p + 5) / 6 - 2 * k / 3) * discrepancy,
+                'dof': ((p - k)**2 - p - k) / 2,
+                'iterations': result.nit,
+                'converged': result.success,
+                'loadings': loadings,
+                'communalities': pd.Series(communalities, index=loadings.index,
+                                           name='Communalities')})
+        return rows
+
+    def analyse_range(self, ks, rotation=False, n_jobs=1):
+        """Fit the model for every number of factors in ks
+        ---------
+        Variables:
+        - ks: Numbers of factors,
+                iterable of int values
+        - rotation: Rotate the loadings of each fit,
+                bool TRUE or FALSE(default)
+        - n_jobs: Number of threads, -1 for all CPUs,
+                int value, 1(default)
+                The sorted ks are cut into n_jobs runs of neighbours,
+                within a run each fit starts from the psi of the previous one
+        ---------
+        Returns:
+        - table: DataFrame indexed by n_factors, with columns
+                error: sum squared residuals of the fit
+                rmsr: root mean squared off-diagonal residual
+                eigenvalue: the n_factors-th eigenvalue of the correlation matrix
+                pc_variance: share of variance of the first n_factors eigenvalues
+                explained: share of variance of the communalities
+                chi2, dof: Bartlett corrected chi-square statistic of the
+                        implied correlation matrix and its degrees of freedom
+                iterations, converged: state of the optimiser
+                loadings: p*n_factor DataFrame
+                communalities: length-p Series
+        """
+        ks = sorted(set(int(k) for k in ks))
+        p = len(self.corr_matrix)
+        if not ks:
+            raise ValueError("'ks' should contain at least one number of factors.")
+        invalid = [k for k in ks if not 1 <= k < p]
+        if invalid:
+            raise ValueError("Numbers of factors should be between 1 and {}, got {}.".format(
+                p - 1, invalid))
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        n_jobs = max(min(n_jobs, len(ks)), 1)
+        chains = [list(chain) for chain in np.array_split(ks, n_jobs)]
+        if n_jobs > 1:
+            with ThreadPoolExecutor(n_jobs) as pool:
+                results = list(pool.map(lambda chain: self._fit_chain(chain, rotation), chains))
+        else:
+            results = [self._fit_chain(ks, rotation)]
+        table = pd.DataFrame([row for rows in results for row in rows])
+        return table.set_index('n_factors')
+
     def get_communalities(self):
         """Calculate the communalities"""
         if self.loadings is not None:
@@ -180,18 +355,19 @@ class FactorAnalysis():
             uniqueness = 1 - communalities
             ar = np.array([communalities, uniqueness]).T
             result = pd.DataFrame(ar, columns=['Communalities', 'Uniqueness'],
-                                  index=self.data.columns)
+                                  index=self.columns)
             return result
 
     def get_score(self):
         """Calculate the scores using Bartlett scores"""
-        if self.loadings is not None:
-            x = bf.central_standard(self.data)
+        if self.loadings is not None and self.data is not None:
+            # Already centred and standardised in __init__
+            x = self._standardised
             lds = self.loadings.values
             uniqueness = self.get_uniqueness().values[:, 0]
-            p = np.diag(1 / uniqueness)
-            part_a = np.linalg.inv(np.dot(np.dot(lds.T, p), lds))
-            part_b = np.dot(np.dot(lds.T, p), (x - np.mean(x, axis=0)).T)
-            f = np.dot(part_a, part_b).T
+            # Loadings^T * Psi^-1, scaling the columns instead of a diagonal matmul
+            w = lds.T / uniqueness
+            part_a = np.linalg.inv(np.dot(w, lds))
+            f = np.dot(x, np.dot(part_a, w).T)
             scores = pd.DataFrame(f, columns=self.loadings.columns)
             return scores
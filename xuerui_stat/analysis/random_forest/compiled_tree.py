@@ -0,0 +1,312 @@
+import threading
+import numpy as np
+
+
+def same_trees(trees, other):
+    """两组决策树是否为同样的对象"""
+    return trees is other or len(trees) == len(other) and all(
+        a is b for a, b in zip(trees, other))
+
+
+class CompiledTree():
+    """
+    以并列的数组储存的决策树，0号为根节点，父节点排在子节点之前（深度优先建树时即为先序）
+    可调用参数：
+    - feature 各节点的划分特征对应列标号，叶节点为-1
+    - threshold 各节点的划分数值，小于该值进入左子树
+    - left, right 各节点左右子节点的编号，叶节点为-1
+    - value 叶节点的类别，非叶节点为-1
+    - count 各节点训练数据中各类别（加权后的）个数，形如(节点数,类别数)，由dict生成时为None
+    - importance 建树时各特征的GINI减少量之和，由dict生成时为None
+    可调用函数：
+    - apply(data) 数据所到达的叶节点编号
+    - predict(data) 预测数据对应类别
+    - to_dict() 转换为{'Info':info,'Left':left,'Right':right}形式的dict
+    - path_length() 训练数据到达叶节点的平均深度，即预测一行平均需要比较的次数
+    - cost_complexity_path() 最弱连接剪枝的完整序列
+    - prune(collapsed) 将指定节点剪为叶节点后的决策树
+    """
+
+    # 储存节点信息的数组名
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'value')
+
+    def __init__(self, feature, threshold, left, right, value, count=None, importance=None):
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.value = np.asarray(value, dtype=np.int32)
+        self.count = None if count is None else np.asarray(count, dtype=np.float64)
+        self.importance = importance
+
+    @classmethod
+    def from_nodes(cls, nodes):
+        """由(feature,threshold,left,right,value[,count])形式的节点列表生成"""
+        return cls(*zip(*nodes))
+
+    @classmethod
+    def from_dict(cls, tree):
+        """由dict形式的决策树生成，按先序编号"""
+        nodes = []
+        # 栈中每项为(子树,父节点编号,是否为右子节点)
+        stack = [(tree, -1, 0)]
+        while stack:
+            sub_tree, parent, side = stack.pop()
+            node = len(nodes)
+            if parent >= 0:
+                nodes[parent][2 + side] = node
+            if type(sub_tree).__name__ == "dict":
+                feature, criteria = sub_tree['Info']
+                nodes.append([feature, criteria, -1, -1, -1])
+                stack.append((sub_tree['Right'], node, 1))
+                stack.append((sub_tree['Left'], node, 0))
+            else:
+                nodes.append([-1, 0.0, -1, -1, sub_tree])
+        return cls.from_nodes(nodes)
+
+    @property
+    def node_count(self):
+        """节点个数"""
+        return len(self.feature)
+
+    def node_depth(self):
+        """各节点的深度，根节点为0，从根节点开始逐层计算"""
+        depth = np.zeros(self.node_count, dtype=np.int32)
+        nodes = np.zeros(1, dtype=np.intp)
+        level = 0
+        while len(nodes):
+            depth[nodes] = level
+            nodes = nodes[self.left[nodes] >= 0]
+            nodes = np.concatenate((self.left[nodes], self.right[nodes]))
+            level += 1
+        return depth
+
+    def path_length(self):
+        """
+        训练数据到达叶节点的平均深度，即预测一行平均需要比较的次数
+        没有count时按各叶节点相同的权重计算
+        """
+        leaf = self.left < 0
+        weight = np.ones(self.node_count) if self.count is None else self.count.sum(axis=1)
+        return float(np.average(self.node_depth()[leaf], weights=weight[leaf]))
+
+    def _parents(self):
+        """各节点的父节点编号，根节点为-1"""
+        parent = np.full(self.node_count, -1, dtype=np.intp)
+        internal = np.flatnonzero(self.left >= 0)
+        parent[self.left[internal]] = internal
+        parent[self.right[internal]] = internal
+        return parent
+
+    def _impurity(self):
+        """各节点的不纯度：节点GINI值乘以节点样本占全部样本的比例，需要count"""
+        total = self.count.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gini = np.where(total > 0, 1 - np.sum((self.count / total[:, None])**2, axis=1), 0)
+        return total / total[0] * gini
+
+    def cost_complexity_path(self):
+        """
+        最弱连接剪枝的完整序列，需要各节点的类别个数count
+        节点的不纯度R(t)为节点GINI值乘以节点样本占全部样本的比例，子树的不纯度R(T_t)为其叶节点不纯度之和，
+        每步剪去g(t)=(R(t)-R(T_t))/(子树叶节点数-1)最小的节点，该步的alpha为g(t)（不小于前一步的alpha）
+        返回(alpha,剪去的节点,剪枝后叶节点的总不纯度,剪枝后的叶节点数)，各为np.array，
+        第0步为未剪枝的树，剪去的节点记为-1
+        """
+        if self.count is None:
+            raise ValueError("The tree has no node counts to prune with.")
+        impurity = self._impurity()
+        internal = self.left >= 0
+        parent = self._parents()
+        # 由深到浅逐层累加得到各子树的不纯度和叶节点数
+        depth = self.node_depth()
+        sub_impurity = np.where(internal, 0.0, impurity)
+        leaves = np.where(internal, 0, 1)
+        for level in range(depth.max() - 1, -1, -1):
+            nodes = np.flatnonzero(internal & (depth == level))
+            sub_impurity[nodes] = sub_impurity[self.left[nodes]] + sub_impurity[self.right[nodes]]
+            leaves[nodes] = leaves[self.left[nodes]] + leaves[self.right[nodes]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = np.where(internal, (impurity - sub_impurity) / (leaves - 1), np.inf)
+        alphas, pruned = [0.0], [-1]
+        impurities, leaves_num = [sub_impurity[0]], [leaves[0]]
+        collapsed = ~internal
+        while internal[0] and not collapsed[0]:
+            node = int(np.argmin(g))
+            alphas.append(max(alphas[-1], g[node]))
+            pruned.append(node)
+            # 子树中的节点都不再参与剪枝，已剪去的子树不再向下遍历
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                g[current] = np.inf
+                if not collapsed[current]:
+                    collapsed[current] = True
+                    stack += [self.left[current], self.right[current]]
+            # 更新各祖先节点的子树不纯度、叶节点数和g(t)
+            change = impurity[node] - sub_impurity[node]
+            removed = leaves[node] - 1
+            sub_impurity[node], leaves[node] = impurity[node], 1
+            ancestor = parent[node]
+            while ancestor >= 0:
+                sub_impurity[ancestor] += change
+                leaves[ancestor] -= removed
+                g[ancestor] = (impurity[ancestor] - sub_impurity[ancestor]) / (leaves[ancestor] - 1)
+                ancestor = parent[ancestor]
+            impurities.append(sub_impurity[0])
+            leaves_num.append(leaves[0])
+        return (np.array(alphas), np.array(pruned), np.array(impurities),
+                np.array(leaves_num))
+
+    def prune(self, collapsed):
+        """
+        将collapsed中的节点剪为叶节点（类别为训练数据中个数最多的类别，相等时取第一个），
+        去掉其下的节点，返回按先序重新编号的新决策树
+        """
+        collapsed = set(int(node) for node in collapsed)
+        nodes = []
+        # 栈中每项为(原节点编号,新父节点编号,是否为右子节点)
+        stack = [(0, -1, 0)]
+        while stack:
+            node, parent, side = stack.pop()
+            new = len(nodes)
+            if parent >= 0:
+                nodes[parent][2 + side] = new
+            count = None if self.count is None else self.count[node]
+            if self.left[node] < 0 or node in collapsed:
+                value = self.value[node] if self.left[node] < 0 else int(np.argmax(count))
+                nodes.append([-1, 0.0, -1, -1, value, count])
+            else:
+                nodes.append([self.feature[node], self.threshold[node], -1, -1, -1, count])
+                stack.append((self.right[node], new, 1))
+                stack.append((self.left[node], new, 0))
+        if self.count is None:
+            return CompiledTree.from_nodes([node[:5] for node in nodes])
+        tree = CompiledTree.from_nodes(nodes)
+        if self.importance is not None:
+            # 剪枝后重新按剩下的划分累加各特征的GINI减少量
+            internal = np.flatnonzero(tree.left >= 0)
+            impurity = tree._impurity()
+            decrease = (impurity[internal] - impurity[tree.left[internal]] -
+                        impurity[tree.right[internal]])
+            tree.importance = np.bincount(tree.feature[internal], decrease,
+                                          minlength=len(self.importance))
+        return tree
+
+    def to_dict(self):
+        """转换为dict形式的决策树，叶节点为类别"""
+        root = {}
+        # 栈中每项为(节点编号,所在的dict,键)
+        stack = [(0, root, 'Tree')]
+        while stack:
+            node, parent, key = stack.pop()
+            if self.left[node] < 0:
+                parent[key] = int(self.value[node])
+            else:
+                sub_tree = {'Info': (int(self.feature[node]), float(self.threshold[node]))}
+                parent[key] = sub_tree
+                stack.append((self.right[node], sub_tree, 'Right'))
+                stack.append((self.left[node], sub_tree, 'Left'))
+        return root['Tree']
+
+    def apply(self, data):
+        """
+        所有行同时从根节点出发，每次向下走一层，直到都到达叶节点
+        返回各行所到达的叶节点编号
+        """
+        node = np.zeros(len(data), dtype=np.intp)
+        rows = np.arange(len(data))
+        while len(rows):
+            current = node[rows]
+            # 去掉已经到达叶节点的行
+            internal = self.left[current] >= 0
+            rows, current = rows[internal], current[internal]
+            # 小于划分数值的进入左子树，否则进入右子树
+            go_left = data[rows, self.feature[current]] < self.threshold[current]
+            node[rows] = np.where(go_left, self.left[current], self.right[current])
+        return node
+
+    def predict(self, data):
+        """预测给定矩阵每行对应类别"""
+        return self.value[self.apply(data)]
+
+
+class RowPredictor():
+    """
+    单行预测用的若干决策树
+    各树的节点数组首尾相接，叶节点的左右子节点都指向自身。所有树同时从根节点出发，
+    每次向下走一层，走满最大深度后都停在叶节点上，不需要逐棵树递归遍历。
+    每层的计算都写入预先分配的数组（每个线程一份），每次预测不再分配数组
+    输入：
+    - trees CompiledTree的列表
+    - categories_num 类别个数
+    - tie_noise 票数相同时选择类别所用的随机数，长度为类别个数，选择其中最大的，默认为None即选第一个
+    """
+
+    def __init__(self, trees, categories_num, tie_noise=None):
+        self.trees = trees
+        self.categories_num = categories_num
+        self.tie_noise = tie_noise
+        offsets = np.cumsum([0] + [tree.node_count for tree in self.trees])
+        self.roots = offsets[:-1].astype(np.intp)
+        feature, children = [], []
+        for tree, offset in zip(self.trees, offsets):
+            ids = np.arange(tree.node_count) + offset
+            leaf = tree.left < 0
+            feature.append(np.where(leaf, 0, tree.feature))
+            # 第2i个为i号节点的右子节点，第2i+1个为左子节点，由“是否进入左子树”直接得到下标
+            children.append(np.column_stack((np.where(leaf, ids, tree.right + offset),
+                                             np.where(leaf, ids, tree.left + offset))).ravel())
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.children = np.concatenate(children).astype(np.intp)
+        self.threshold = np.concatenate([tree.threshold for tree in self.trees])
+        self.value = np.concatenate([tree.value for tree in self.trees]).astype(np.intp)
+        self.depth = max([int(tree.node_depth().max()) for tree in self.trees] + [0])
+        self._local = threading.local()
+
+    def built_from(self, trees):
+        """是否由这些决策树生成，随机森林每次给出同一个列表，直接比较列表即可"""
+        return same_trees(trees, self.trees)
+
+    def _buffers(self):
+        """当前线程的预分配数组，第一次调用时分配"""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            n = len(self.roots)
+            buffers = (np.empty(n, dtype=np.intp), np.empty(n, dtype=np.intp),
+                       np.empty(n), np.empty(n), np.empty(n, dtype=bool),
+                       np.empty(self.categories_num, dtype=np.intp),
+                       np.empty(self.categories_num, dtype=bool))
+            self._local.buffers = buffers
+        return buffers
+
+    def vote_count(self, row):
+        """
+        row为float64向量，返回各类别所得票数（预分配的数组，下次调用时会被覆盖）
+        """
+        node, index, x, threshold, go_left, votes, tied = self._buffers()
+        node[:] = self.roots
+        for level in range(self.depth):
+            np.take(self.feature, node, out=index, mode='clip')
+            np.take(row, index, out=x, mode='clip')
+            np.take(self.threshold, node, out=threshold, mode='clip')
+            # 小于划分数值的进入左子树，否则进入右子树
+            np.less(x, threshold, out=go_left)
+            np.multiply(node, 2, out=index)
+            np.add(index, go_left, out=index)
+            np.take(self.children, index, out=node, mode='clip')
+        np.take(self.value, node, out=index, mode='clip')
+        votes[:] = 0
+        np.add.at(votes, index, 1)
+        return votes
+
+    def predict(self, row):
+        """预测row对应类别，票数最多的类别不止一个时按tie_noise选择"""
+        votes, tied = self._buffers()[-2:]
+        self.vote_count(row)
+        result = int(votes.argmax())
+        if self.tie_noise is not None:
+            np.equal(votes, votes[result], out=tied)
+            if np.count_nonzero(tied) > 1:
+                result = int(np.argmax(np.where(tied, self.tie_noise, -1)))
+        return result
@@ -1,9 +1,13 @@
+import os
+import heapq
 import numpy as np
 import pandas as pd
-import random as ra
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from .preprocessing import PreProcessing
+from .preprocessing import PreProcessing, read_chunks
+from .compiled_tree import CompiledTree, RowPredictor, same_trees
+from .model_file import write_model, read_model
+from .metrics import Metrics, confusion_count
 
 class DecisionTree(PreProcessing):
     """
@@ -12,85 +16,369 @@ class DecisionTree(PreProcessing):
     输入：
     - data 用于训练决策树的数据，类型为DataFrame
     - cat_name 类别特征名称
+    - random_state 随机种子，用于叶节点中类别数相同时的选择，默认为None即不固定
+    - dtype, order 训练用特征矩阵的类型和储存顺序，见PreProcessing
     输出：无
     可调用参数：无
     可调用函数：
-    - train(max_depth,min_gini)
+    - train(max_depth,min_gini,binning,random_state,
+            min_samples_split,min_samples_leaf,max_leaf_nodes,min_impurity_decrease,growth)
         用于生成决策树
         输出：
-        - 一个dict类型的决策树，结构形如{'Info':info,'Left':left,'Right':right}
+        - 以数组形式储存的决策树（CompiledTree），可由self.tree得到dict形式，
+         结构形如{'Info':info,'Left':left,'Right':right}
          其中Info包含两项：划分特征对应列标号以及划分的具体数值。
          Left和Right分别储存左右子树或最终划分结果
     - test(test_data)
         用于测试预测能力
         输出：
-        - 记录混淆矩阵在self.confusion_matrix中，返回平均误差
-    - predict(data)
-        用于预测data对应类别
+        - 记录混淆矩阵在self.confusion_matrix中，全部评价指标（Metrics）在self.metrics中，返回平均误差
+    - test_iter(chunks), test_file(path,chunksize)
+        逐块检验，评价指标逐块累加，不需要将全部数据读入内存，输出同test
+    - predict(data,n_jobs)
+        用于预测data对应类别，行数较多时可按行分块用n_jobs个线程同时预测
         输出；
         - 类别
+    - predict_one(row)
+        单行预测的快速路径，用于在线逐行预测，结果与predict相同
+    - predict_iter(chunks,labels), predict_file(path,chunksize,output,labels)
+        逐块预测DataFrame或矩阵的迭代器，或逐块读取的CSV/Parquet文件，内存占用只与每块大小有关
+        输出：
+        - 逐块返回预测结果np.array，或将预测的类别名写入output文件
+    - feature_importances
+        各特征的GINI减少量重要性，建树时累加，以特征名为索引的Series，总和为1
+    - prune(alpha), cost_complexity_path()
+        代价复杂度剪枝，剪枝序列只计算一次并缓存，对不同的alpha剪枝不需要重新训练
+        输出：
+        - 剪枝前后的节点数、叶节点数和平均路径长度；剪枝序列各步的alpha、不纯度、叶节点数和节点数
+    - save(path)
+        将训练好的模型（不含训练数据）以二进制格式保存到path
+    - DecisionTree.load(path,mmap)
+        读取save保存的模型，读取的模型可用于预测，但不含训练数据，不能再训练
+        mmap为True时节点数组以只读方式映射到内存，直接用于预测，多个进程可共用同一份内存
     """
 
-    def __init__(self, data, cat_name):
-        super().__init__(data, cat_name)
-        self.tree = None
+    # 多线程预测时每个线程至少分到的行数，行数更少时线程池的开销大于收益，直接在当前线程预测
+    PARALLEL_MIN_ROWS = 20000
+
+    def __init__(self, data, cat_name, random_state=None, dtype=np.float64, order='C'):
+        super().__init__(data, cat_name, dtype, order)
+        self.test_data = None
+        self.confusion_matrix = None
+        self.metrics = None
+        self._tree = None
+        # 单行预测所用的RowPredictor，第一次调用predict_one时生成
+        self._predictor = None
+        # 剪枝前的决策树及其剪枝序列，第一次剪枝时计算
+        self._pruning = None
+        self.random_state = random_state
+        # 模型自己的随机数生成器，不使用全局的random模块
+        self._rng = np.random.default_rng(self._seed_sequence(None))
+
+    @property
+    def tree(self):
+        """dict形式的决策树，结构形如{'Info':info,'Left':left,'Right':right}"""
+        if self._tree is not None:
+            return self._tree.to_dict()
+
+    @tree.setter
+    def tree(self, tree):
+        self._tree = None if tree is None else CompiledTree.from_dict(tree)
+
+    def _compiled_trees(self):
+        """模型中以数组储存的全部决策树"""
+        return [] if self._tree is None else [self._tree]
+
+    def _set_compiled_trees(self, trees):
+        """设置模型中以数组储存的决策树"""
+        self._tree = trees[0]
+
+    def _model_info(self):
+        """保存模型时需要记录的参数"""
+        random_state = self.random_state
+        if not isinstance(random_state, (int, np.integer)):
+            # 只记录整数种子
+            random_state = None
+        return {'rows_num': self.rows_num, 'columns_num': self.columns_num,
+                'random_state': None if random_state is None else int(random_state)}
+
+    def _restore(self, header, arrays):
+        """由模型文件的内容恢复模型（不含训练数据）"""
+        self._cat_name = header['cat_name']
+        self.features = pd.Index(header['features'])
+        self.categories = header['categories']
+        self.x = self.y = None
+        self._predictor = None
+        self._pruning = None
         self.test_data = None
         self.confusion_matrix = None
+        self.metrics = None
+        info = header['info']
+        self.rows_num, self.columns_num = info['rows_num'], info['columns_num']
+        self.random_state = info['random_state']
+        self._rng = np.random.default_rng(self._seed_sequence(None))
+        # 各树的节点在数组中首尾相连，由tree_offsets分开，每棵树只取数组的一段，不复制
+        offsets = arrays['tree_offsets'].tolist()
+        count = arrays.get('count')
+        importance = arrays.get('importance')
+        trees = [CompiledTree(*(arrays[name][start:end] for name in CompiledTree.ARRAYS),
+                              count=None if count is None else count[start:end],
+                              importance=None if importance is None else importance[i])
+                 for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]))]
+        self._set_compiled_trees(trees)
+
+    def save(self, path):
+        """
+        将训练好的模型以二进制格式保存到path
+        各树的节点数组首尾相连地储存，同时记录类别名、特征名等信息，不保存训练数据
+        """
+        trees = self._compiled_trees()
+        if not trees:
+            raise ValueError("The model is not trained.")
+        arrays = {'tree_offsets': np.cumsum(
+            [0] + [tree.node_count for tree in trees], dtype=np.int64)}
+        for name in CompiledTree.ARRAYS:
+            arrays[name] = np.concatenate([getattr(tree, name) for tree in trees])
+        if all(tree.count is not None for tree in trees):
+            # 各节点的类别个数，用于读取后剪枝
+            arrays['count'] = np.concatenate([tree.count for tree in trees])
+        if all(tree.importance is not None for tree in trees):
+            # 各树各特征的GINI减少量，形如(树数,特征数)
+            arrays['importance'] = np.array([tree.importance for tree in trees])
+        header = {'model': type(self).__name__,
+                  'cat_name': self._cat_name,
+                  'features': self.features.tolist(),
+                  'categories': list(self.categories),
+                  'info': self._model_info()}
+        write_model(path, header, arrays)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """
+        读取save保存的模型
+        mmap为True时节点数组以只读方式映射到内存，预测时直接使用映射的数据，不复制
+        """
+        header, arrays = read_model(path, mmap)
+        if header['model'] != cls.__name__:
+            raise TypeError("'%s' is a %s model." % (path, header['model']))
+        model = cls.__new__(cls)
+        model._restore(header, arrays)
+        return model
+
+    def _check_trainable(self):
+        """由文件读取的模型不含训练数据，不能训练"""
+        if self.x is None:
+            raise ValueError("The model is loaded from a file and has no training data.")
 
-    def _get_gini(self, data):
+    def _seed_sequence(self, random_state):
+        """
+        由random_state得到SeedSequence，为None时使用构造时给出的random_state
+        random_state可以是整数、SeedSequence或numpy的Generator
+        """
+        if random_state is None:
+            random_state = self.random_state
+        if isinstance(random_state, np.random.SeedSequence):
+            return random_state
+        if isinstance(random_state, np.random.Generator):
+            return np.random.SeedSequence(random_state.integers(2**63))
+        return np.random.SeedSequence(random_state)
+
+    def _presort(self, x):
+        """每个特征只在根节点排序一次，返回形如(特征数, 行数)的int32行号矩阵"""
+        index = np.empty((x.shape[1], x.shape[0]), dtype=np.int32)
+        for feature in range(x.shape[1]):
+            index[feature] = np.argsort(x[:, feature], kind='mergesort')
+        return index
+
+    def _bin_features(self, x, max_bins):
+        """
+        将各特征按分位数分为至多max_bins箱，
+        返回uint8类型的箱号矩阵，以及各特征相邻两箱之间的边界值
+        第b箱中的值都满足 x<edges[b]，因此边界值可直接作为划分点
+        """
+        if not 1 < max_bins <= 255:
+            raise ValueError("'binning' should be between 2 and 255.")
+        codes = np.empty(x.shape, dtype=np.uint8)
+        edges = []
+        for feature in range(x.shape[1]):
+            column = np.sort(x[:, feature])
+            values = np.unique(column).astype(np.float64)
+            if len(values) <= max_bins:
+                # 取值个数不多时每个值单独一箱，边界为相邻两值的中点
+                edge = (values[:-1] + values[1:]) / 2
+            else:
+                # 否则取各分位数与比它小的相邻取值的中点作为边界
+                pos = len(column) * np.arange(1, max_bins) // max_bins
+                upper = np.unique(np.searchsorted(values, column[pos]))
+                upper = upper[upper > 0]
+                edge = (values[upper - 1] + values[upper]) / 2
+            codes[:, feature] = np.searchsorted(edge, x[:, feature], side='right')
+            edges.append(edge)
+        return codes, edges
+
+    def _set_training(self, x, y, weight, sorted_index=None, binned=None):
+        """
+        记录建树所需的数据
+        - x 特征矩阵；y 类别向量；weight 每行的权重（bootstrap中被抽中的次数）
+        - sorted_index 由_presort得到的各特征排序行号
+        - binned 分箱模式下由_bin_features得到的箱号矩阵和边界值
+        每个节点对应self._index中同一段[start,end)，每行都是该节点数据按对应特征排好序的行号，
+        划分时只对这一段做稳定的分区，不复制数据也不重新排序
+        分箱模式下self._index只有一行，节点用各类别在各箱中的直方图寻找划分点
+        """
+        self._y = y
+        self._weight = weight
+        in_bag = weight > 0
+        if binned is not None:
+            self._x = None
+            self._codes, self._edges = binned
+            self._bins = max(len(edge) for edge in self._edges) + 1
+            self._index = np.flatnonzero(in_bag).astype(np.int32)[None]
+        elif in_bag.all():
+            self._x = x
+            self._codes = None
+            # 划分时会原地重排self._index，复制一份以免改动整个森林共用的排序
+            self._index = sorted_index.copy()
+        else:
+            self._x = x
+            self._codes = None
+            # 去掉权重为0的行，各行保持原有顺序
+            self._index = sorted_index[in_bag[sorted_index]].reshape(
+                len(sorted_index), -1)
+        self._goes_left = np.zeros(len(y), dtype=bool)
+        self._min_leaf = 1
+
+    def _clear_training(self):
+        """释放建树时使用的数据"""
+        self._x = self._y = self._weight = None
+        self._codes = self._edges = None
+        self._index = self._goes_left = None
+
+    def _training_arrays(self):
+        """用于建树的特征矩阵和类别向量"""
+        return self.x, self.y
+
+    def _get_count(self, start, end):
+        """统计节点中各类别（加权后的）个数"""
+        rows = self._index[0, start:end]
+        return np.bincount(self._y[rows], self._weight[rows],
+                           minlength=len(self.categories))
+
+    def _get_gini(self, start, end):
         """计算GINI值"""
-        total = len(data)
-        # 统计各类别概率
+        return self._gini(self._get_count(start, end))
+
+    def _gini(self, count):
+        """由各类别个数计算GINI值"""
+        total = count.sum()
         if total:
-            count = dict(Counter(data[:, -1]))
-            count = list(count.values())
-            f = lambda x: (x / total)**2
-            pr2 = list(map(f, count))
-            # 计算gini值
-            gini = 1 - sum(pr2)
+            gini = 1 - np.sum((count / total)**2)
         else:
             gini = 0
         return gini
 
-    def _split_gini(self, data, split_index):
-        """计算排序后的数据在split_index前分成两份后的GINI值"""
-        part_1 = data[:split_index]
-        part_2 = data[split_index:]
-        pr = split_index / len(data)
-        gini = pr * self._get_gini(part_1) + \
-            (1 - pr) * self._get_gini(part_2)
+    def _get_hist(self, start, end):
+        """分箱模式下统计节点中各特征各箱内各类别（加权后的）个数，形如(特征数, 箱数, 类别数)"""
+        rows = self._index[0, start:end]
+        k = len(self.categories)
+        p = self._codes.shape[1]
+        # 将(特征, 箱号, 类别)展开成一维位置后一次计数
+        position = (self._codes[rows].astype(np.intp) +
+                    np.arange(p) * self._bins) * k + self._y[rows, None]
+        weight = np.broadcast_to(self._weight[rows, None], position.shape)
+        hist = np.bincount(position.ravel(), weight.ravel(),
+                           minlength=p * self._bins * k)
+        return hist.reshape(p, self._bins, k)
+
+    def _child_hists(self, start, middle, end, hist):
+        """
+        划分后左右子节点的直方图
+        只对样本较少的一侧直接计数，另一侧由父节点直方图减去得到
+        """
+        if hist is None:
+            return None, None
+        if middle - start <= end - middle:
+            left = self._get_hist(start, middle)
+            return left, hist - left
+        right = self._get_hist(middle, end)
+        return hist - right, right
+
+    def _boundary_gini(self, left_count, total_count):
+        """
+        由各划分点左侧各类别个数和节点各类别总数，计算所有划分点的GINI值
+        类别位于最后一维，节点各类别总数可以按划分点广播（批量计算多个节点时）
+        有一侧（加权后的）样本数少于self._min_leaf（默认为1，即没有数据）的划分点记为无穷大
+        """
+        right_count = total_count - left_count
+        left_num = left_count.sum(axis=-1)
+        right_num = right_count.sum(axis=-1)
+        total = total_count.sum(axis=-1)
+        # 左右两份各自的GINI值，再按样本比例加权
+        pr = left_num / total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            left_gini = 1 - np.sum((left_count / left_num[..., None])**2, axis=-1)
+            right_gini = 1 - np.sum((right_count / right_num[..., None])**2, axis=-1)
+        gini = pr * left_gini + (1 - pr) * right_gini
+        gini[(left_num < self._min_leaf) | (right_num < self._min_leaf)] = np.inf
         return gini
 
-    def _split_criteria(self, data, feature):
-        """遍历index，获取数据对应特征的最佳划分点和最小GINI值"""
-        smallest = 1
-        # 将数据按对应特征从小到大排序
-        sorted_data = data[np.argsort(data[:, feature])]
-        for i in range(len(data) - 1):
-            # 只在对应特征的值变化时考虑划分
-            # 如果在第i个和第i+1个之间划分
-            if sorted_data[i, feature] != sorted_data[i + 1, feature]:
-                # 计算GINI函数
-                f = self._split_gini(sorted_data, i + 1)
-                # 保留最小的GINI和对应的划分点
-                if f < smallest:
-                    smallest = f
-                    index = i
-        if smallest == 1:
+    def _split_criteria(self, index, feature):
+        """
+        获取节点数据对应特征的最佳划分点和最小GINI值
+        index为该节点数据按对应特征已排好序的行号，
+        用各类别的累计计数一次性算出所有划分点的GINI值
+        """
+        if len(index) < 2:
+            return 'none', 1
+        values = self._x[index, feature]
+        # 各类别的one-hot矩阵（以权重代替1），逐行累加得到在第i个和第i+1个之间划分时左侧各类别个数
+        onehot = np.zeros((len(index), len(self.categories)))
+        onehot[np.arange(len(index)), self._y[index]] = self._weight[index]
+        left_count = np.cumsum(onehot, axis=0)
+        gini = self._boundary_gini(left_count[:-1], left_count[-1])
+        # 只在对应特征的值变化时考虑划分
+        gini[values[:-1] == values[1:]] = np.inf
+        # 保留最小的GINI和对应的划分点（相等时取最前面的划分点）
+        i = int(np.argmin(gini))
+        smallest = gini[i]
+        if not smallest < 1:
             # 说明没能划分（避免所有特征对应值都相同，但类别不同的数据的情况）
-            split_criteria = 'none'
-        else:
-            # 对应的划分点为两相邻数据对应特征的中点
-            split_criteria = (
-                sorted_data[index, feature] + sorted_data[index + 1, feature]) / 2
+            return 'none', 1
+        # 对应的划分点为两相邻数据对应特征的中点（按float64计算，避免float32下中点与数据重合）
+        split_criteria = (float(values[i]) + float(values[i + 1])) / 2
         return split_criteria, smallest
 
-    def _split_feature(self, data):
+    def _split_criteria_hist(self, hist, feature):
+        """分箱模式下由节点直方图获取对应特征的最佳划分点和最小GINI值"""
+        if self._bins < 2:
+            return 'none', 1
+        # 逐箱累加得到在第b箱和第b+1箱之间划分时左侧各类别个数
+        left_count = np.cumsum(hist[feature], axis=0)
+        gini = self._boundary_gini(left_count[:-1], left_count[-1])
+        b = int(np.argmin(gini))
+        smallest = gini[b]
+        if not smallest < 1:
+            return 'none', 1
+        # 对应的划分点为两箱之间的边界值
+        return self._edges[feature][b], smallest
+
+    def _candidate_features(self):
+        """候选划分特征"""
+        return range(self.columns_num - 1)
+
+    def _split_feature(self, start, end, hist=None):
         """遍历特征，获取最佳划分特征和最佳划分点"""
+        return self._best_split(start, end, hist)[:2]
+
+    def _best_split(self, start, end, hist=None):
+        """遍历特征，获取最佳划分特征、最佳划分点以及划分后的GINI值"""
         smallest = 1
-        for element in range(self.columns_num - 1):
+        for element in self._candidate_features():
             # 获取element对应特征的最佳划分点和最小GINI
-            (x, f) = self._split_criteria(data, element)
+            if hist is None:
+                (x, f) = self._split_criteria(self._index[element, start:end], element)
+            else:
+                (x, f) = self._split_criteria_hist(hist, element)
             # 保留最小的GINI和对应的划分点
             if f < smallest:
                 smallest = f
@@ -99,124 +387,602 @@ class DecisionTree(PreProcessing):
         if smallest == 1:
             # 说明没能划分（避免所有值都相同，但类别不同的数据的情况）
             split_feature, split_criteria = 'none', 'none'
-        return split_feature, split_criteria
+        return split_feature, split_criteria, smallest
 
-    def _split(self, data, info, left=True):
-        """对传入数据在指定位置进行划分，根据True或False返回左侧或右侧数据"""
+    def _split(self, start, end, info):
+        """
+        对节点[start,end)在指定位置进行划分，左侧数据移到前面，右侧数据移到后面，
+        各特征的行号保持排好的顺序，返回左右两段的分界位置
+        """
         feature, criteria = info
-        if left:
-            result = data[data[:, feature] < criteria]
+        segment = self._index[:, start:end]
+        rows = segment[0]
+        if self._codes is None:
+            self._goes_left[rows] = self._x[rows, feature] < np.float64(criteria)
+        else:
+            # 划分点为第b箱的上边界，即箱号不大于b的数据划入左侧
+            b = np.searchsorted(self._edges[feature], criteria)
+            self._goes_left[rows] = self._codes[rows, feature] <= b
+        left = self._goes_left[segment]
+        num = np.count_nonzero(left[0])
+        segment[:] = np.concatenate(
+            (segment[left].reshape(len(segment), num),
+             segment[~left].reshape(len(segment), -1)), axis=1)
+        return start + num
+
+    def _choose_class(self, count):
+        """由节点各类别个数选择类别"""
+        # 如果有多个类别总数相等且最多，随机选择其中一个
+        max_cat = np.flatnonzero(count == count.max()).tolist()
+        return max_cat[self._rng.integers(len(max_cat))]
+
+    def _tree_limits(self, max_depth, min_gini, min_samples_split=2, min_samples_leaf=1,
+                     max_leaf_nodes=0, min_impurity_decrease=0, growth='depth'):
+        """检查并整理建树的停止条件，参数见train"""
+        if max_depth>0:
+            # 当给出最大层数
+            input_max_d=max_depth
+        else:
+            # 当不传入最大层数，默认不设限制
+            input_max_d=2*self.rows_num
+        if min_samples_split < 2:
+            raise ValueError("'min_samples_split' should be at least 2.")
+        if min_samples_leaf < 1:
+            raise ValueError("'min_samples_leaf' should be at least 1.")
+        if max_leaf_nodes < 0 or max_leaf_nodes == 1:
+            raise ValueError("'max_leaf_nodes' should be 0 or at least 2.")
+        if min_impurity_decrease < 0:
+            raise ValueError("'min_impurity_decrease' should be non-negative.")
+        if growth not in ('depth', 'breadth'):
+            raise ValueError("'growth' should be 'depth' or 'breadth'.")
+        if max_leaf_nodes:
+            growth = 'best'
+        return {'max_depth': input_max_d, 'min_gini': min_gini,
+                'min_samples_split': min_samples_split, 'min_samples_leaf': min_samples_leaf,
+                'max_leaf_nodes': max_leaf_nodes, 'min_impurity_decrease': min_impurity_decrease,
+                'growth': growth}
+
+    def _node_split(self, start, end, depth, hist=None):
+        """
+        寻找节点[start,end)的最佳划分，返回(节点各类别个数,划分)，划分为(划分特征,划分点,GINI减少量,直方图)，
+        GINI减少量按节点样本占全部样本的比例加权；达到停止条件或无法划分时划分为None
+        分箱模式下hist为该节点的直方图，为None时在需要划分时计算
+        """
+        limits = self._limits
+        count = self._get_count(start, end)
+        total = count.sum()
+        gini = self._gini(count)
+        # 如果数据中包含不同类别，GINI大于min_gini，且样本足够多，进行划分
+        if not (gini > limits['min_gini'] and depth < limits['max_depth'] and
+                total >= limits['min_samples_split'] and
+                total >= 2 * limits['min_samples_leaf']):
+            return count, None
+        if self._codes is not None and hist is None:
+            hist = self._get_hist(start, end)
+        feature, criteria, smallest = self._best_split(start, end, hist)
+        # 可能出现有不同类别但无法划分的情况
+        if feature == 'none' or criteria == 'none':
+            return count, None
+        decrease = total / self._total_weight * (gini - smallest)
+        if limits['min_impurity_decrease'] > 0 and decrease < limits['min_impurity_decrease']:
+            return count, None
+        return count, (feature, criteria, decrease, hist)
+
+    def _add_leaf(self, node, count):
+        """将节点node记为叶节点，count为节点各类别（加权后的）个数"""
+        self._nodes[node] = [-1, 0.0, -1, -1, self._choose_class(count), count]
+
+    def _depth_first(self, end):
+        """
+        按深度优先的顺序建树，用显式的栈代替递归，不受递归深度的限制，节点按先序编号
+        栈中每项为(父节点编号,是否为右子节点,start,end,深度,直方图)
+        """
+        stack = [(-1, 0, 0, end, 0, None)]
+        while stack:
+            parent, side, start, end, depth, hist = stack.pop()
+            node = len(self._nodes)
+            self._nodes.append(None)
+            if parent >= 0:
+                self._nodes[parent][2 + side] = node
+            count, split = self._node_split(start, end, depth, hist)
+            if split is None:
+                # 若已达到设定分类限制，或确实无法划分，则记录当前类别结果
+                self._add_leaf(node, count)
+                continue
+            # 确实可以划分，则记录划分信息，左右子节点入栈
+            feature, criteria, decrease, hist = split
+            self._importance[feature] += decrease
+            middle = self._split(start, end, (feature, criteria))
+            if depth + 1 < self._limits['max_depth']:
+                left_hist, right_hist = self._child_hists(start, middle, end, hist)
+            else:
+                left_hist, right_hist = None, None
+            self._nodes[node] = [feature, criteria, -1, -1, -1, count]
+            # 右子节点先入栈，左子节点先出栈，即按先序处理
+            stack.append((node, 1, middle, end, depth + 1, right_hist))
+            stack.append((node, 0, start, middle, depth + 1, left_hist))
+
+    def _level_rows(self, starts, ends):
+        """
+        一层中各节点的数据在self._index中的位置，首尾相接
+        返回(位置,各位置所属节点的序号,各节点在位置中的起点)
+        """
+        lengths = ends - starts
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.intp)
+        seg = np.repeat(np.arange(len(starts)), lengths)
+        pos = np.arange(lengths.sum()) - offsets[seg] + starts[seg]
+        return pos, seg, offsets
+
+    def _level_criteria(self, pos, seg, offsets, count, feature):
+        """
+        批量获取一层各节点对应特征的最佳划分点和最小GINI值，做法同_split_criteria
+        各节点的数据首尾相接一起累计计数，再减去各节点起点之前的部分
+        """
+        index = self._index[feature, pos]
+        values = self._x[index, feature]
+        onehot = np.zeros((len(index), len(self.categories)))
+        onehot[np.arange(len(index)), self._y[index]] = self._weight[index]
+        cum = np.cumsum(onehot, axis=0)
+        before = np.zeros((len(offsets), cum.shape[1]))
+        before[1:] = cum[offsets[1:] - 1]
+        gini = self._boundary_gini(cum - before[seg], count[seg])
+        # 各节点最后一个位置之后没有划分点，对应特征的值不变时也不划分
+        same = np.ones(len(index), dtype=bool)
+        same[:-1] = values[:-1] == values[1:]
+        same[np.append(offsets[1:] - 1, len(index) - 1)] = True
+        gini[same] = np.inf
+        # 各节点最小的GINI值和对应的划分点（相等时取最前面的划分点）
+        smallest = np.minimum.reduceat(gini, offsets)
+        first = np.flatnonzero(gini == smallest[seg])
+        i = first[np.unique(seg[first], return_index=True)[1]]
+        j = np.minimum(i + 1, len(index) - 1)
+        criteria = (values[i].astype(np.float64) + values[j].astype(np.float64)) / 2
+        return criteria, smallest
+
+    def _level_criteria_hist(self, pos, seg, cands):
+        """
+        分箱模式下批量获取一层各节点各候选特征的最佳划分点和最小GINI值，形如(节点数,候选特征数)
+        cands为各节点的候选特征，形如(节点数,候选特征数)，只统计各节点候选特征的直方图，
+        各节点的直方图用一次bincount得到，节点较多时分组计算以限制内存
+        """
+        k = len(self.categories)
+        nodes_num, m = cands.shape
+        if self._bins < 2:
+            # 各特征都只有一个值，无法划分，同_split_criteria_hist
+            return np.zeros((nodes_num, m)), np.full((nodes_num, m), np.inf)
+        size = m * self._bins * k
+        group = max(1, 2**22 // size)
+        edges = np.full((self._codes.shape[1], self._bins), np.nan)
+        for feature, edge in enumerate(self._edges):
+            edges[feature, :len(edge)] = edge
+        criteria = np.empty((nodes_num, m))
+        smallest = np.empty((nodes_num, m))
+        for first in range(0, nodes_num, group):
+            last = min(first + group, nodes_num)
+            part = (seg >= first) & (seg < last)
+            rows = self._index[0, pos[part]]
+            # 将(节点, 候选特征, 箱号, 类别)展开成一维位置后一次计数
+            position = (((seg[part, None] - first) * m + np.arange(m)) * self._bins +
+                        self._codes[rows[:, None], cands[seg[part]]]) * k + self._y[rows, None]
+            weight = np.broadcast_to(self._weight[rows, None], position.shape)
+            hist = np.bincount(position.ravel(), weight.ravel(),
+                               minlength=(last - first) * size)
+            left_count = np.cumsum(hist.reshape(last - first, m, self._bins, k), axis=2)
+            gini = self._boundary_gini(left_count[:, :, :-1], left_count[:, :, -1:])
+            b = np.argmin(gini, axis=2)
+            smallest[first:last] = np.take_along_axis(gini, b[..., None], axis=2)[..., 0]
+            criteria[first:last] = edges[cands[first:last], b]
+        return criteria, smallest
+
+    def _level_split(self, pos, seg, offsets, count):
+        """
+        批量寻找一层各节点的最佳划分，返回各节点的划分特征（无法划分为-1）、划分点和划分后的GINI值
+        特征的选择同_best_split：取GINI最小的，相等时取候选特征中靠前的
+        只计算各节点候选特征的GINI：按特征把以它为候选的节点放在一起计算，随机森林中不计算其他特征
+        """
+        nodes_num = len(offsets)
+        p = self.columns_num - 1
+        # 各节点的候选特征，以及各特征在候选特征中的次序，非候选特征为无穷大
+        cands = np.array([list(self._candidate_features()) for i in range(nodes_num)],
+                         dtype=np.intp).reshape(nodes_num, -1)
+        node_rows = np.arange(nodes_num)[:, None]
+        rank = np.full((nodes_num, p), np.inf)
+        rank[node_rows, cands] = np.arange(cands.shape[1])
+        criteria = np.zeros((nodes_num, p))
+        gini = np.full((nodes_num, p), np.inf)
+        if self._codes is None:
+            starts = pos[offsets]
+            ends = starts + np.diff(np.append(offsets, len(pos)))
+            for feature in np.flatnonzero(np.isfinite(rank).any(axis=0)):
+                sub = np.flatnonzero(np.isfinite(rank[:, feature]))
+                if len(sub) == nodes_num:
+                    rows = (pos, seg, offsets)
+                else:
+                    rows = self._level_rows(starts[sub], ends[sub])
+                criteria[sub, feature], gini[sub, feature] = self._level_criteria(
+                    *rows, count[sub], feature)
         else:
-            result = data[data[:, feature] >= criteria]
-        return result
-
-    def _classify(self, data):
-        """为叶节点选择类别"""
-        # 统计各类别总数
-        count = dict(Counter(data))
-        # 选择各类别最多的
-        m = max(count.values())
-        # 如果有多个类别总数相等且最多
-        max_cat = [key for key in count if count[key] == m]
-        cho = ra.choice(max_cat)
-        return cho
-
-    def _treeRecursion(self, data, min_gini, depth, max_depth):
-        """构建决策树的递归函数"""
-        gini = self._get_gini(data)
-        # 如果数据中包含不同类别，GINI大于min_gini，进行划分
-        if gini > min_gini and depth < max_depth:
-            feature, criteria = self._split_feature(data)
-            # 可能出现有不同类别但无法划分的情况
-            if feature != 'none' and criteria != 'none':
-                # 确实可以划分，则记录划分信息，并分左右子树递归
-                info = (feature, criteria)
-                tree = {'Info': info}
-                tree['Left'] = self._treeRecursion(
-                    self._split(data, info, True), min_gini, depth + 1, max_depth)
-                tree['Right'] = self._treeRecursion(
-                    self._split(data, info, False), min_gini, depth + 1, max_depth)
-                return tree
+            criteria[node_rows, cands], gini[node_rows, cands] = self._level_criteria_hist(
+                pos, seg, cands)
+        smallest = gini.min(axis=1)
+        feature = np.argmin(np.where(gini == smallest[:, None], rank, np.inf), axis=1)
+        # 说明没能划分（避免所有值都相同，但类别不同的数据的情况）
+        feature[~(smallest < 1)] = -1
+        return feature, criteria[np.arange(nodes_num), feature], smallest
+
+    def _level_partition(self, pos, seg, feature, criteria):
+        """
+        一次划分一层的全部节点，做法同_split：各节点左侧数据移到前面，右侧数据移到后面，
+        各特征的行号保持排好的顺序，返回各节点左侧的数据个数
+        """
+        rows = self._index[0, pos]
+        if self._codes is None:
+            self._goes_left[rows] = self._x[rows, feature[seg]] < criteria[seg]
+        else:
+            b = np.array([np.searchsorted(self._edges[f], c) for f, c in zip(feature, criteria)])
+            self._goes_left[rows] = self._codes[rows, feature[seg]] <= b[seg]
+        segment = self._index[:, pos]
+        left = self._goes_left[segment]
+        # 按(节点, 是否在右侧)稳定排序，各节点内左右两部分各自保持原有顺序
+        order = np.argsort(seg * 2 + ~left, axis=1, kind='stable')
+        self._index[:, pos] = np.take_along_axis(segment, order, axis=1)
+        return np.bincount(seg, left[0], minlength=len(feature)).astype(np.intp)
+
+    def _breadth_first(self, end):
+        """
+        按广度优先的顺序建树，每次处理一层的全部节点：一次统计各节点各类别的个数，
+        批量寻找各节点的最佳划分，再一次完成各节点的划分，节点按层编号
+        """
+        limits = self._limits
+        k = len(self.categories)
+        self._nodes.append(None)
+        nodes = np.zeros(1, dtype=np.intp)
+        starts = np.zeros(1, dtype=np.intp)
+        ends = np.full(1, end, dtype=np.intp)
+        depth = 0
+        while len(nodes):
+            pos, seg, offsets = self._level_rows(starts, ends)
+            rows = self._index[0, pos]
+            count = np.bincount(seg * k + self._y[rows], self._weight[rows],
+                                minlength=len(nodes) * k).reshape(len(nodes), k)
+            total = count.sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gini = np.where(total > 0, 1 - np.sum((count / total[:, None])**2, axis=1), 0)
+            splittable = ((gini > limits['min_gini']) & (depth < limits['max_depth']) &
+                          (total >= limits['min_samples_split']) &
+                          (total >= 2 * limits['min_samples_leaf']))
+            feature = np.full(len(nodes), -1)
+            criteria = np.zeros(len(nodes))
+            if splittable.any():
+                chosen = np.flatnonzero(splittable)
+                sub_pos, sub_seg, sub_offsets = self._level_rows(starts[chosen], ends[chosen])
+                f, c, smallest = self._level_split(sub_pos, sub_seg, sub_offsets, count[chosen])
+                decrease = total[chosen] / self._total_weight * (gini[chosen] - smallest)
+                if limits['min_impurity_decrease'] > 0:
+                    f[decrease < limits['min_impurity_decrease']] = -1
+                np.add.at(self._importance, f[f >= 0], decrease[f >= 0])
+                feature[chosen], criteria[chosen] = f, c
+            split = np.flatnonzero(feature >= 0)
+            middle = starts[split]
+            if len(split):
+                sub_pos, sub_seg, sub_offsets = self._level_rows(starts[split], ends[split])
+                middle = middle + self._level_partition(
+                    sub_pos, sub_seg, feature[split], criteria[split])
+            # 按层内顺序编号，左右子节点相邻
+            children = len(self._nodes) + 2 * np.arange(len(split))
+            self._nodes += [None] * (2 * len(split))
+            for i, node in enumerate(nodes.tolist()):
+                if feature[i] < 0:
+                    self._add_leaf(node, count[i])
+            for i, left in zip(split.tolist(), children.tolist()):
+                self._nodes[nodes[i]] = [int(feature[i]), float(criteria[i]), left, left + 1, -1,
+                                         count[i]]
+            nodes = np.column_stack((children, children + 1)).ravel()
+            starts = np.column_stack((starts[split], middle)).ravel()
+            ends = np.column_stack((middle, ends[split])).ravel()
+            depth += 1
+
+    def _best_first(self, end):
+        """
+        按最佳优先的顺序建树：候选划分放在以GINI减少量为优先级的堆中，
+        每次划分减少量最大的节点，叶节点数达到max_leaf_nodes后停止，剩下的候选节点都记为叶节点
+        """
+        heap = []
+
+        def push(node, start, end, depth, hist):
+            count, split = self._node_split(start, end, depth, hist)
+            if split is None:
+                self._add_leaf(node, count)
             else:
-                # 确实无法划分，则返回类别结果
-                cat = self._classify(data[:, -1])
-                return cat
+                # 减少量相同时先划分编号小的节点
+                heapq.heappush(heap, (-split[2], node, start, end, depth, count, split))
+
+        self._nodes.append(None)
+        push(0, 0, end, 0, None)
+        leaves = 1
+        while heap and leaves < self._limits['max_leaf_nodes']:
+            _, node, start, end, depth, count, split = heapq.heappop(heap)
+            feature, criteria, decrease, hist = split
+            self._importance[feature] += decrease
+            middle = self._split(start, end, (feature, criteria))
+            left_hist, right_hist = self._child_hists(start, middle, end, hist)
+            left = len(self._nodes)
+            self._nodes += [None, None]
+            self._nodes[node] = [feature, criteria, left, left + 1, -1, count]
+            push(left, start, middle, depth + 1, left_hist)
+            push(left + 1, middle, end, depth + 1, right_hist)
+            leaves += 1
+        for _, node, start, end, depth, count, split in heap:
+            self._add_leaf(node, count)
+
+    def _build_tree(self, limits):
+        """对已记录的训练数据按停止条件limits（由_tree_limits得到）建树，返回CompiledTree"""
+        self._nodes = []
+        self._limits = limits
+        self._min_leaf = limits['min_samples_leaf']
+        self._total_weight = self._weight[self._index[0]].sum()
+        # 各特征的GINI减少量，在实际划分时累加
+        self._importance = np.zeros(self.columns_num - 1)
+        if limits['growth'] == 'best':
+            self._best_first(self._index.shape[1])
+        elif limits['growth'] == 'breadth':
+            self._breadth_first(self._index.shape[1])
         else:
-            # 若已达到设定分类限制，返回当前类别结果
-            cat = self._classify(data[:, -1])
-            return cat
+            self._depth_first(self._index.shape[1])
+        tree = CompiledTree.from_nodes(self._nodes)
+        tree.importance = self._importance
+        self._nodes = self._limits = self._importance = None
+        return tree
 
-    def train(self, max_depth=0, min_gini=0):
+    def train(self, max_depth=0, min_gini=0, binning=0, random_state=None,
+              min_samples_split=2, min_samples_leaf=1, max_leaf_nodes=0, min_impurity_decrease=0,
+              growth='depth'):
         """
         对所给数据构建决策树
         参数：
             max_depth: 树结构的最大层树，达到最大值后停止构建子树，默认为无限制
             mini_gini：损失函数的最小值，达到最小值后停止构建子树，默认为0
+            binning: 分箱个数（不超过255），各特征先按分位数分箱，再用各箱的直方图寻找划分点，
+                     划分点为箱之间的边界值，默认为0即不分箱
+            random_state: 随机种子，默认为None即使用构造时给出的random_state
+            min_samples_split: 节点样本数少于该值时不再划分，默认为2
+            min_samples_leaf: 划分后左右子节点的样本数都不能少于该值，默认为1
+            max_leaf_nodes: 叶节点数的上限，给出时按GINI减少量从大到小的顺序（最佳优先）划分节点，
+                            默认为0即不设限制，按深度优先建树
+            min_impurity_decrease: 划分使GINI减少的量（按节点样本占全部样本的比例加权）
+                                   小于该值时不划分，默认为0
+            以上样本数均按权重计算，在随机森林中即计入bootstrap重复抽中的次数
+            growth: 建树顺序，'depth'为深度优先（默认），'breadth'为广度优先，每次批量处理一层的全部节点，
+                    两者都不使用递归；给出max_leaf_nodes时总是按最佳优先的顺序
         """
-        if max_depth>0:
-            # 当给出最大层数
-            input_max_d=max_depth
+        self._check_trainable()
+        limits = self._tree_limits(max_depth, min_gini, min_samples_split, min_samples_leaf,
+                                   max_leaf_nodes, min_impurity_decrease, growth)
+        self._rng = np.random.default_rng(self._seed_sequence(random_state))
+        x, y = self._training_arrays()
+        if binning:
+            self._set_training(x, y, np.ones(len(x)),
+                               binned=self._bin_features(x, binning))
         else:
-            # 当不传入最大层数，默认不设限制
-            input_max_d=2*self.rows_num
-        self.tree = self._treeRecursion(self.data, min_gini, 0, input_max_d)
+            self._set_training(x, y, np.ones(len(x)), self._presort(x))
+        self._tree = self._build_tree(limits)
+        self._clear_training()
 
-    def _search(self, tree, data):
+    def _feature_matrix(self, data):
         """
-        按给定tree搜寻给定data的对应路径，返回路径终点（叶节点）对应类别
+        取出输入数据中的特征列，转为float矩阵
+        DataFrame按特征名取列（类别列可有可无、列顺序不限），缺少训练特征时报错；
+        矩阵取前columns_num-1列
         """
-        feature, criteria = tree['Info']
-        # 如果小于边界值，进入左子树
-        if data[feature] < criteria:
-            sub_tree = tree['Left']
-        else:
-            # 否则进入右子树
-            sub_tree = tree['Right']
-        # 对子树迭代，重复上述过程，直到达到叶节点
-        if type(sub_tree).__name__ == "dict":
-            result = self._search(sub_tree, data)
-        else:
-            result = sub_tree
-        return result
+        if isinstance(data, pd.DataFrame):
+            features = self.features[:-1]
+            missing = features[~features.isin(data.columns)]
+            if len(missing):
+                raise ValueError("The data is missing the features: {}.".format(list(missing)))
+            return data[features].to_numpy(dtype=float)
+        data = np.asarray(data)
+        return np.asarray(data[:, :self.columns_num - 1], dtype=float)
 
-    def predict(self, data):
-        """预测给定data对应类别"""
-        if self.tree != None:
+    def _map_rows(self, func, data, n_jobs):
+        """
+        将矩阵按行分块，用线程池对各块分别计算func后按行合并
+        树的遍历都是释放GIL的numpy数组运算，各线程可以同时计算，也不需要复制模型；
+        每块至少PARALLEL_MIN_ROWS行，行数不够分两块时直接计算
+        """
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        n_jobs = min(n_jobs, len(data) // self.PARALLEL_MIN_ROWS)
+        if n_jobs <= 1:
+            return func(data)
+        bounds = np.linspace(0, len(data), n_jobs + 1).astype(int)
+        with ThreadPoolExecutor(n_jobs) as pool:
+            parts = pool.map(func, [data[a:b] for a, b in zip(bounds[:-1], bounds[1:])])
+            return np.concatenate(list(parts))
+
+    def predict(self, data, n_jobs=1):
+        """
+        预测给定data对应类别，data为矩阵时对所有行同时预测，返回np.array
+        n_jobs为同时预测的线程数，-1为使用全部CPU，默认为1即不使用多线程
+        """
+        if self._tree is not None:
             # 对于输入data为向量的情况
             if data.ndim == 1:
-                result = self._search(self.tree, data)
+                result = int(self.predict(data[None])[0])
             # 对于输入data为矩阵的情况
             else:
-                f = lambda x: self._search(self.tree, x)
-                result = list(map(f, data))
+                result = self._map_rows(self._tree.predict, self._feature_matrix(data), n_jobs)
             return result
 
+    def _tie_noise(self):
+        """单行预测时票数相同的类别之间选择所用的随机数，决策树每次只有一票，不需要"""
+        return None
+
+    def _row_predictor(self):
+        """单行预测所用的RowPredictor，决策树改变后重新生成，未训练时为None"""
+        trees = self._compiled_trees()
+        if not trees:
+            return None
+        if self._predictor is None or not self._predictor.built_from(trees):
+            self._predictor = RowPredictor(trees, len(self.categories), self._tie_noise())
+        return self._predictor
+
+    def predict_one(self, row):
+        """
+        单行预测的快速路径：row为一行数据的向量（可以含末位的类别），返回类别对应数字
+        所有树同时逐层遍历数组形式的节点，计算都写入预先分配的数组，结果与predict(row)相同
+        """
+        predictor = self._row_predictor()
+        if predictor is not None:
+            return predictor.predict(np.asarray(row, dtype=np.float64))
+
+    def _encode_labels(self, cats):
+        """将类别名按训练数据转为数字，出现训练数据中没有的类别时报错"""
+        codes = pd.Index(self.categories).get_indexer(cats)
+        if (codes < 0).any():
+            raise ValueError("The category feature '%s' has values not seen in training."
+                             % self._cat_name)
+        return codes
+
+    def _chunk_labels(self, chunk):
+        """取出一块数据的真实类别：DataFrame按类别名转为数字，矩阵取末列"""
+        if isinstance(chunk, pd.DataFrame):
+            return self._encode_labels(chunk[self._cat_name])
+        return np.asarray(chunk)[:, -1].astype(np.intp)
+
+    def predict_iter(self, chunks, labels=False, **kwargs):
+        """
+        逐块预测，chunks为DataFrame或矩阵的可迭代对象（如read_chunks的结果），
+        每块预测完即返回该块的预测结果np.array，不需要将全部数据读入内存
+        - labels 为True时返回(预测结果,真实类别)，真实类别按训练数据转为数字，每块中须含有类别
+        - kwargs 传给predict的其他参数
+        """
+        for chunk in chunks:
+            result = self.predict(self._feature_matrix(chunk), **kwargs)
+            yield (result, self._chunk_labels(chunk)) if labels else result
+
+    def predict_file(self, path, chunksize=10000, output=None, labels=False, **kwargs):
+        """
+        逐块读取CSV或Parquet文件并预测，每次只读入chunksize行，见read_chunks
+        - output 为None时返回逐块预测结果的迭代器，同predict_iter；
+          否则将预测的类别名逐块写入CSV文件output（列名为类别特征名），返回预测的行数，此时labels无效
+        """
+        chunks = read_chunks(path, chunksize, self.features)
+        if output is None:
+            return self.predict_iter(chunks, labels, **kwargs)
+        names = np.asarray(self.categories, dtype=object)
+        count = 0
+        with open(output, 'w', newline='') as f:
+            for result in self.predict_iter(chunks, **kwargs):
+                pd.DataFrame({self._cat_name: names[result]}).to_csv(
+                    f, header=count == 0, index=False)
+                count += len(result)
+        return count
+
     def _compare(self,true_cat, pred_cat):
         """比较真实值与预测值，返回矩阵"""
-        k = len(self.categories)
-        mat = np.zeros((k, k))
         # 矩阵ij位置表示真实值为i，预测值为j的个数
-        for h in range(len(true_cat)):
-            i = int(true_cat[h])
-            j = int(pred_cat[h])
-            mat[i, j] += 1
+        mat = confusion_count(true_cat, pred_cat, len(self.categories))
         mat = pd.DataFrame(mat, columns=self.categories, index=self.categories)
         return mat
 
+    @property
+    def feature_importances(self):
+        """
+        各特征的GINI减少量重要性：建树时每次划分的GINI减少量（按节点样本占全部样本的比例加权）
+        按划分特征累加，多棵树时各树相加，再归一化使总和为1，不需要再遍历决策树
+        返回以特征名为索引的Series，由dict设置的决策树没有该信息，返回None
+        """
+        trees = self._compiled_trees()
+        if trees and all(tree.importance is not None for tree in trees):
+            importance = np.sum([tree.importance for tree in trees], axis=0)
+            if importance.sum() > 0:
+                importance = importance / importance.sum()
+            return pd.Series(importance, index=self.features[:-1])
+
+    def _pruning_paths(self):
+        """
+        剪枝前的决策树及其最弱连接剪枝序列，第一次调用时计算并缓存，
+        之后的剪枝都从剪枝前的决策树开始；决策树重新训练或被替换后重新计算
+        """
+        trees = self._compiled_trees()
+        if not trees:
+            raise ValueError("The model is not trained.")
+        if self._pruning is None or not same_trees(trees, self._pruning['current']):
+            self._pruning = {'trees': trees, 'current': trees,
+                             'paths': [tree.cost_complexity_path() for tree in trees]}
+        return self._pruning
+
+    def _path_table(self, path):
+        """将剪枝序列整理为DataFrame"""
+        alphas, pruned, impurities, leaves = path
+        return pd.DataFrame({'alpha': alphas, 'impurity': impurities,
+                             'leaves': leaves, 'nodes': 2 * leaves - 1})
+
+    def cost_complexity_path(self):
+        """
+        最弱连接剪枝的完整序列，每行为一步剪枝后的alpha、叶节点总不纯度、叶节点数和节点数，
+        第0行为未剪枝的树；prune(alpha)即剪到alpha不大于给定值的最后一步
+        """
+        return self._path_table(self._pruning_paths()['paths'][0])
+
+    def _trees_summary(self, trees):
+        """决策树的节点数、叶节点数和平均路径长度（多棵树时为各树的平均）"""
+        return {'nodes': sum(tree.node_count for tree in trees),
+                'leaves': sum(int(np.count_nonzero(tree.left < 0)) for tree in trees),
+                'path_length': np.mean([tree.path_length() for tree in trees])}
+
+    def prune(self, alpha):
+        """
+        按代价复杂度剪枝：从剪枝前的决策树开始，剪去剪枝序列中alpha不大于给定alpha的各步，
+        alpha为0时恢复剪枝前的决策树；剪枝后预测需要比较的次数更少
+        返回剪枝前后的节点数、叶节点数和平均路径长度（训练数据到达叶节点的平均深度）
+        """
+        pruning = self._pruning_paths()
+        trees = []
+        for tree, (alphas, pruned, impurities, leaves) in zip(pruning['trees'], pruning['paths']):
+            collapsed = pruned[1:][alphas[1:] <= alpha] if alpha > 0 else []
+            trees.append(tree.prune(collapsed) if len(collapsed) else tree)
+        self._set_compiled_trees(trees)
+        pruning['current'] = self._compiled_trees()
+        return pd.DataFrame([self._trees_summary(pruning['trees']), self._trees_summary(trees)],
+                            index=['before', 'after'])
+
+    def _predict_with_proba(self, data):
+        """预测矩阵各行的类别，同时给出属于各类别的概率，决策树不给出概率（为None）"""
+        return self.predict(data), None
+
+    def _evaluate(self, chunks):
+        """逐块预测，累加评价指标，返回Metrics"""
+        metrics = Metrics(self.categories)
+        for chunk in chunks:
+            result, proba = self._predict_with_proba(self._feature_matrix(chunk))
+            metrics.update(self._chunk_labels(chunk), result, proba)
+        return metrics
+
     def test(self, *test_data):
         """对所给模型做检验"""
         if test_data == ():
             # 在不输入新的检验数据的情况下，用原数据进行检验
             self.test_data = self.data
         else:
-            if type(test_data)==pd.core.frame.DataFrame:
-                # 对输入的新数据做与原数据一样的数据处理
-                self.test_data = PreProcessing(test_data[0], self._cat_name).data
+            if isinstance(test_data[0], pd.DataFrame):
+                # 对输入的新数据按训练数据的特征顺序取列，类别按训练数据转为数字
+                self.test_data = np.column_stack((self._feature_matrix(test_data[0]),
+                                                  self._chunk_labels(test_data[0])))
             else:
                 self.test_data=test_data[0]
-        # 预测测试数据类别
-        result = self.predict(self.test_data)
+        return self.test_iter([self.test_data])
+
+    def test_iter(self, chunks):
+        """
+        逐块检验，chunks为含有类别的DataFrame或矩阵（类别位于末列）的可迭代对象，
+        各块的混淆矩阵等指标逐块累加，不保留数据
+        """
+        self.metrics = self._evaluate(chunks)
         # 记录混淆矩阵
-        self.confusion_matrix = self._compare(self.test_data[:, -1],result)
-        error=1-np.trace(self.confusion_matrix)/len(self.test_data)
-        return error
+        self.confusion_matrix = self.metrics.confusion_matrix
+        return self.metrics.error
+
+    def test_file(self, path, chunksize=10000):
+        """逐块读取CSV或Parquet文件并检验，每次只读入chunksize行，见read_chunks"""
+        return self.test_iter(read_chunks(path, chunksize, self.features))
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+
+def confusion_count(true_cat, pred_cat, categories_num):
+    """
+    由真实类别与预测类别（均为数字0，1，2……）统计混淆矩阵，ij位置为真实值为i、预测值为j的个数
+    将每对(i,j)编为一个数i*k+j，用一次bincount统计
+    """
+    true_cat = np.asarray(true_cat, dtype=np.intp)
+    pred_cat = np.asarray(pred_cat, dtype=np.intp)
+    k = categories_num
+    return np.bincount(true_cat * k + pred_cat, minlength=k * k).reshape(k, k)
+
+
+class Metrics():
+    """
+    分类结果的评价指标，可以逐块累加，不需要保留全部数据
+    输入：
+    - categories 所有类别名
+    可调用函数：
+    - update(true_cat,pred_cat,proba)
+        累加一块数据的真实类别与预测类别（数字0，1，2……），
+        proba为各行属于各类别的概率（如predict_proba的结果），给出时同时累加log-loss
+    - report()
+        各类别的precision、recall、F1以及真实个数，形如(类别数,4)的DataFrame
+    可调用参数：
+    - count 混淆矩阵的计数，ij位置为真实值为i、预测值为j的个数
+    - confusion_matrix 以类别名为行列名的混淆矩阵
+    - accuracy, error 准确率与误差
+    - precision, recall, f1 各类别的指标，某类别没有预测（或真实）样本时为nan
+    - log_loss 平均的负对数似然，没有累加过proba时为nan
+    """
+
+    # 计算log-loss时概率的下限，避免log(0)
+    EPS = 1e-15
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        k = len(self.categories)
+        self.count = np.zeros((k, k), dtype=np.int64)
+        self._loss_sum = 0.0
+        self._loss_num = 0
+
+    def update(self, true_cat, pred_cat, proba=None):
+        """累加一块数据的结果"""
+        self.count += confusion_count(true_cat, pred_cat, len(self.categories))
+        if proba is not None:
+            true_cat = np.asarray(true_cat, dtype=np.intp)
+            # 每行取真实类别对应的概率
+            p = np.asarray(proba)[np.arange(len(true_cat)), true_cat]
+            self._loss_sum -= np.log(np.clip(p, self.EPS, 1)).sum()
+            self._loss_num += len(true_cat)
+        return self
+
+    @property
+    def total(self):
+        """累加的行数"""
+        return int(self.count.sum())
+
+    @property
+    def confusion_matrix(self):
+        return pd.DataFrame(self.count, index=self.categories, columns=self.categories)
+
+    @property
+    def accuracy(self):
+        return np.trace(self.count) / self.total
+
+    @property
+    def error(self):
+        return 1 - self.accuracy
+
+    def _ratio(self, axis):
+        """对角线除以各列（axis=0）或各行（axis=1）的和"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return pd.Series(np.diag(self.count) / self.count.sum(axis=axis),
+                             index=self.categories)
+
+    @property
+    def precision(self):
+        return self._ratio(0)
+
+    @property
+    def recall(self):
+        return self._ratio(1)
+
+    @property
+    def f1(self):
+        precision, recall = self.precision, self.recall
+        return 2 * precision * recall / (precision + recall)
+
+    @property
+    def log_loss(self):
+        if self._loss_num == 0:
+            return np.nan
+        return self._loss_sum / self._loss_num
+
+    def report(self):
+        """各类别的precision、recall、F1以及真实个数"""
+        return pd.DataFrame({'precision': self.precision, 'recall': self.recall,
+                             'f1': self.f1, 'support': self.count.sum(axis=1)})
@@ -0,0 +1,80 @@
+import json
+import struct
+import numpy as np
+
+
+# 模型文件格式：
+# - 8字节的文件标识 MAGIC
+# - 8字节（小端无符号整数）的数组数据起始位置
+# - UTF-8编码的JSON文件头，记录模型信息以及各数组的dtype、shape和相对起始位置
+# - 各数组的原始数据，每个数组的起始位置都按64字节对齐，可以直接用内存映射读取
+MAGIC = b'XRSTATMD'
+VERSION = 1
+ALIGN = 64
+
+
+def _aligned(size):
+    """按ALIGN字节对齐后的大小"""
+    return -(-size // ALIGN) * ALIGN
+
+
+def write_model(path, header, arrays):
+    """
+    将模型写入文件
+    参数：
+    - header 可以转为JSON的dict，记录模型信息
+    - arrays 数组名为键、np.array为值的dict
+    """
+    specs = {}
+    offset = 0
+    for name, array in arrays.items():
+        specs[name] = {'dtype': array.dtype.str, 'shape': list(array.shape),
+                       'offset': offset}
+        offset += _aligned(array.nbytes)
+    header = dict(header, version=VERSION, arrays=specs)
+    text = json.dumps(header).encode('utf-8')
+    start = _aligned(len(MAGIC) + 8 + len(text))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', start))
+        # 用空格补齐文件头，JSON解析时会忽略
+        f.write(text.ljust(start - len(MAGIC) - 8))
+        for name, array in arrays.items():
+            f.seek(start + specs[name]['offset'])
+            f.write(np.ascontiguousarray(array).tobytes())
+
+
+def read_header(f, path):
+    """读取文件头，返回(文件头,数组数据起始位置)"""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("'%s' is not a model file." % path)
+    start, = struct.unpack('<Q', f.read(8))
+    header = json.loads(f.read(start - len(MAGIC) - 8).decode('utf-8'))
+    if header['version'] > VERSION:
+        raise ValueError("The model file version %d is not supported." % header['version'])
+    return header, start
+
+
+def read_model(path, mmap=False):
+    """
+    读取模型文件，返回(文件头,数组名为键的dict)
+    mmap为True时以只读方式将整个文件映射到内存，各数组都是映射的一段，不复制数据，
+    多个进程读取同一文件时共用同一份页缓存
+    """
+    with open(path, 'rb') as f:
+        header, start = read_header(f, path)
+        arrays = {}
+        if mmap:
+            buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            count = int(np.prod(shape))
+            offset = start + spec['offset']
+            if mmap:
+                array = buffer[offset:offset + count * dtype.itemsize].view(dtype)
+            else:
+                f.seek(offset)
+                array = np.fromfile(f, dtype=dtype, count=count)
+            arrays[name] = array.reshape(shape)
+    return header, arrays
@@ -11,22 +11,20 @@ class PlotTree():
         self._arrow_args = dict(arrowstyle="<-")
 
     def __get_tree_depth(self,tree):
-        """获取树的深度"""
+        """获取树的深度，用栈逐个访问节点，不使用递归"""
         depth = 0
-        # 定义的dict中首位储存的是节点信息，不计入计数
-        for key in ('Left', 'Right'):
-            # 记录各子节点的深度
-            sub_tree = tree[key]
-            if type(sub_tree).__name__ == "dict":
-                # 如果该节点有分支，迭代计算该节点的深度
-                thisdepth = self.__get_tree_depth(sub_tree)
-            else:
-                # 否则深度为一
-                thisdepth = 1
+        # 栈中每项为(子树,该子树根节点的深度)
+        stack = [(tree, 1)]
+        while stack:
+            sub_tree, thisdepth = stack.pop()
             # 比较各分支深度，保留最深记录
             if thisdepth > depth:
                 depth = thisdepth
-        # 分支深度加一即为当前节点深度
+            # 定义的dict中首位储存的是节点信息，不计入计数
+            for key in ('Left', 'Right'):
+                if type(sub_tree[key]).__name__ == "dict":
+                    stack.append((sub_tree[key], thisdepth + 1))
+        # 叶节点比最深的分支节点再深一层
         return depth + 1
 
 
@@ -43,41 +41,55 @@ class PlotTree():
                             ha="center", rotation=30)
 
     def __plot_tree(self,tree, prnt_pt, node_txt, branch=None):
-        self._layer += 1
-        diff = 1 / 2**(self._layer)
-        keys = list(tree.keys())
-        text = tree[keys[0]]
-        if branch == 'Left':
-            self._xOff -= diff
-        elif branch == 'Right':
-            self._xOff += diff
-        else:
-            pass
-        cntr_pt = (self._xOff, self._yOff)
-        self.__plot_mid_text(cntr_pt, prnt_pt, node_txt)
-        self.__plot_node(text, cntr_pt, prnt_pt, self._decision_node)
-        self._yOff = self._yOff - 1.0 / self._totalD
-        for key in keys[1:]:
-            sub_tree = tree[key]
-            if type(sub_tree).__name__ == 'dict':
-                self.__plot_tree(sub_tree, cntr_pt, str(key), key)
-            else:
-                if key == 'Left':
-                    x = self._xOff - diff / 2
-                elif key == 'Right':
-                    x = self._xOff + diff / 2
+        """用栈代替递归画出各节点，栈中为进入子树或离开子树两种操作"""
+        stack = [('enter', tree, prnt_pt, node_txt, branch)]
+        while stack:
+            item = stack.pop()
+            if item[0] == 'leave':
+                # 离开子树时恢复进入前的位置
+                branch = item[1]
+                diff = 1 / 2**(self._layer)
+                if branch == 'Left':
+                    self._xOff += diff
+                elif branch == 'Right':
+                    self._xOff -= diff
                 else:
                     pass
-                self.__plot_node(sub_tree, (x, self._yOff), cntr_pt, self._leaf_node)
-                self.__plot_mid_text((x, self._yOff), cntr_pt, str(key))
-        if branch == 'Left':
-            self._xOff += diff
-        elif branch == 'Right':
-            self._xOff -= diff
-        else:
-            pass
-        self._layer -= 1
-        self._yOff = self._yOff + 1.0 / self._totalD
+                self._layer -= 1
+                self._yOff = self._yOff + 1.0 / self._totalD
+                continue
+            tree, prnt_pt, node_txt, branch = item[1:]
+            self._layer += 1
+            diff = 1 / 2**(self._layer)
+            keys = list(tree.keys())
+            text = tree[keys[0]]
+            if branch == 'Left':
+                self._xOff -= diff
+            elif branch == 'Right':
+                self._xOff += diff
+            else:
+                pass
+            cntr_pt = (self._xOff, self._yOff)
+            self.__plot_mid_text(cntr_pt, prnt_pt, node_txt)
+            self.__plot_node(text, cntr_pt, prnt_pt, self._decision_node)
+            self._yOff = self._yOff - 1.0 / self._totalD
+            # 先画叶节点，再按顺序进入各分支，最后离开当前子树
+            sub_trees = []
+            for key in keys[1:]:
+                sub_tree = tree[key]
+                if type(sub_tree).__name__ == 'dict':
+                    sub_trees.append(('enter', sub_tree, cntr_pt, str(key), key))
+                else:
+                    if key == 'Left':
+                        x = self._xOff - diff / 2
+                    elif key == 'Right':
+                        x = self._xOff + diff / 2
+                    else:
+                        pass
+                    self.__plot_node(sub_tree, (x, self._yOff), cntr_pt, self._leaf_node)
+                    self.__plot_mid_text((x, self._yOff), cntr_pt, str(key))
+            stack.append(('leave', branch))
+            stack.extend(reversed(sub_trees))
 
     def tree_structure_plot(self):
         fig = plt.figure(1, facecolor='white')
@@ -9,53 +9,75 @@ class PreProcessing():
     传入参数：
     - data 用于训练决策树的数据，类型为DataFrame
     - cat_name 类别特征名称
+    - dtype 特征矩阵的类型，np.float64（默认）或np.float32
+    - order 特征矩阵的储存顺序，'C'为按行连续储存（默认），'F'为按列连续储存，按特征扫描时更快
     可调用参数：
     - rows_num 数据行数
     - columns_num 数据列数
-    - features 数据所有特征名
-    - categories 数据所有类别名
-    - data 重置后的数据，类型为np.array
-    可调用函数：无
+    - features 数据所有特征名（类别特征置于末位）
+    - categories 数据所有类别名，按首次出现的顺序排列
+    - x 除类别特征外的特征矩阵，类型为连续储存的float np.array
+    - y 类别转化为数字0，1，2……后的向量，类型为能容纳所有类别的最小的无符号整数np.array
+    - data 由x和y合并而成的矩阵，类别位于末列
+    可调用函数：
+    - memory_usage() 返回x和y所占内存的字节数
     """
 
-    def __init__(self, data, cat_name):
+    def __init__(self, data, cat_name, dtype=np.float64, order='C'):
         self._cat_name=cat_name
         (self.rows_num, self.columns_num) = data.shape
-        self.data = self.__cats_to_last(data, cat_name)
-        self.features = self.data.columns
-        self.categories = self.__get_cat()
-        self.data=self.data.values
-        self.__cats_to_nums()
-
-
-    def __cats_to_last(self, data, cat_name):
-        """将类别特征置于末位"""
-        # 获取类别特征所在列
-        right = data.loc[:, cat_name]
-        # 获取其他所有特征矩阵
-        left = data.drop(cat_name, axis=1)
-        # 合并左右列（用concat而非join因为join会重新按index排序）
-        out = pd.concat([left,right],axis=1)
-        return out
-
-    def __get_cat(self):
-        """获取所有类别名称"""
-        # 提取类别特征对应向量
-        cats=list(self.data[self._cat_name])
-        # 删去重复项
-        out=list(set(cats))
-        # 按照原顺序排列（set会改变顺序，导致每次运行顺序不同）
-        out.sort(key=cats.index)
-        return out
-
-    def __cats_to_nums(self):
-        """将数据集中的划分类别转化为0，1，2……"""
-        # 遍历数据集每行元素
-        for i in range(self.rows_num):
-            # 寻找与该行类别匹配的类
-            for j in range(len(self.categories)):
-                # 将匹配到的类别改为数字并退出循环
-                if self.data[i, -1] == self.categories[j]:
-                    self.data[i, -1] = j
-                    break
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise TypeError("'dtype' should be np.float32 or np.float64.")
+        if order not in ('C', 'F'):
+            raise ValueError("'order' should be 'C' or 'F'.")
+        self.features = self.__cats_to_last(data.columns, cat_name)
+        self.categories, self.y = self.__cats_to_nums(data[cat_name])
+        self.x = np.asarray(data.drop(cat_name, axis=1).to_numpy(dtype=dtype),
+                            order=order)
 
+    @property
+    def data(self):
+        """由x和y合并而成的矩阵，类别位于末列"""
+        return np.column_stack((self.x, self.y))
+
+    def memory_usage(self):
+        """x和y所占内存的字节数"""
+        usage = pd.Series({'x': self.x.nbytes, 'y': self.y.nbytes})
+        usage['total'] = usage.sum()
+        return usage
+
+    def __cats_to_last(self, columns, cat_name):
+        """将类别特征名置于末位"""
+        return columns.drop(cat_name).append(pd.Index([cat_name]))
+
+    def __cats_to_nums(self, cats):
+        """获取所有类别名称（按原顺序排列），并将类别转化为0，1，2……"""
+        codes, uniques = pd.factorize(cats, sort=False)
+        if (codes < 0).any():
+            raise ValueError("The category feature '%s' has missing values." % self._cat_name)
+        return uniques.tolist(), codes.astype(np.min_scalar_type(max(len(uniques) - 1, 0)))
+
+
+def read_chunks(path, chunksize=10000, columns=None):
+    """
+    按块读取CSV或Parquet文件（扩展名为.parquet或.pq时按Parquet读取），
+    每次返回不超过chunksize行的DataFrame，内存占用只与chunksize有关，与文件大小无关
+    - columns 需要读取的列名，文件中没有的列会被忽略，默认为None即读取全部列
+    读取Parquet文件需要安装pyarrow
+    """
+    wanted = None if columns is None else set(columns)
+    if str(path).lower().endswith(('.parquet', '.pq')):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pyarrow.")
+        parquet = pq.ParquetFile(path)
+        if wanted is not None:
+            columns = [name for name in parquet.schema_arrow.names if name in wanted]
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        usecols = None if wanted is None else (lambda name: name in wanted)
+        for chunk in pd.read_csv(path, chunksize=chunksize, usecols=usecols):
+            yield chunk
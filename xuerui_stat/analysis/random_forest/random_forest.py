@@ -1,12 +1,46 @@
+import os
+import copy
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
-import random as ra
-from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
 from .preprocessing import PreProcessing
 from .decision_tree import DecisionTree
+from .compiled_tree import CompiledTree
 
 
+# 子进程中的随机森林（不含数据）以及共享内存中的训练数据
+_worker={}
+
+def _to_shared(array):
+    """将数组复制到共享内存中，返回可传给子进程的(共享内存,dtype,shape,储存顺序)"""
+    if array is None:
+        return None
+    order='F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+    spec=(mp.RawArray('b',max(array.nbytes,1)),array.dtype.str,array.shape,order)
+    _from_shared(spec)[...]=array
+    return spec
+
+def _from_shared(spec):
+    """由(共享内存,dtype,shape,储存顺序)得到不复制数据的数组"""
+    if spec is None:
+        return None
+    raw,dtype,shape,order=spec
+    return np.frombuffer(raw,dtype=dtype,count=int(np.prod(shape))).reshape(shape,order=order)
+
+def _init_worker(forest,specs,edges):
+    """子进程初始化：记录随机森林，并从共享内存取出训练数据"""
+    x,y,sorted_index,codes=[_from_shared(spec) for spec in specs]
+    binned=None if codes is None else (codes,edges)
+    _worker['forest']=forest
+    _worker['data']=(x,y,sorted_index,binned)
+
+def _train_tree(task):
+    """子进程中训练一棵决策树"""
+    seed,limits=task
+    return _worker['forest']._train_tree(seed,*_worker['data'],limits)
+
 
 class RandomForest(DecisionTree):
     """
@@ -15,49 +49,121 @@ class RandomForest(DecisionTree):
     输入：
     - data 用于训练决策树的数据，类型为DataFrame
     - cat_name 类别特征名称
+    - random_state 随机种子，用于bootstrap抽样、子特征选择等，默认为None即不固定
+    - dtype, order 训练用特征矩阵的类型和储存顺序，见PreProcessing
     输出：无
     可调用参数：无
     可调用函数：
-    - train(num_tree,max_depth,min_gini,subf_num)
+    - train(num_tree,max_depth,min_gini,subf_num,binning,n_jobs,random_state,
+            min_samples_split,min_samples_leaf,max_leaf_nodes,min_impurity_decrease,growth)
         用于生成决策树
         输出：
-        -1> 一个dict类型的决策树，记录在self.tree中，结构形如{'Info':info,'Left':left,'Right':right}
+        -1> 以数组形式储存的多棵决策树（CompiledTree），可由self.tree得到以序号为键的dict，
+            每棵树结构形如{'Info':info,'Left':left,'Right':right}
             其中Info包含两项：划分特征对应列标号以及划分的具体数值。
             Left和Right分别储存左右子树或最终划分结果
-        -2> Out of Bag(OOB)误差，记录在self.oob_error中
-    - test(test_data)
-        用于测试预测能力
+        -2> Out of Bag(OOB)误差，记录在self.oob_error中，为每行只用未抽中它的树投票所得的整体误差
+            各行投给各类别的OOB票数比例记录在self.oob_decision_function中（从未被OOB的行为nan），
+            OOB混淆矩阵记录在self.oob_confusion_matrix中
+    - test(test_data), test_iter(chunks), test_file(path,chunksize)
+        用于测试预测能力，见DecisionTree，self.metrics中还包含由票数比例计算的log-loss
         输出：
         - 记录混淆矩阵在self.confusion_matrix中，返回平均误差
-    - predict(data)
-        用于预测data对应类别
+    - predict(data,n_jobs,random_state)
+        用于预测data对应类别，可用n_jobs个线程同时预测，参数顺序同DecisionTree.predict，
+        票数相同的类别之间按由random_state（只能按名字给出）随机得到的固定优先顺序选择
         输出；
         - 类别
+    - predict_iter(chunks,labels,random_state), predict_file(path,chunksize,output,labels,random_state)
+        逐块预测，见DecisionTree
+    - feature_importances
+        各特征的GINI减少量重要性，各树建树时累加的结果相加后归一化，见DecisionTree
+    - permutation_importance(n_repeats,n_jobs,random_state)
+        在各树的OOB样本上打乱各特征计算准确率的下降，需要训练数据
+        输出：
+        - 以特征名为索引的DataFrame，importance为准确率下降的平均值，std为各次打乱之间的标准差
+    - prune(alpha), cost_complexity_path()
+        对每棵树分别做代价复杂度剪枝，见DecisionTree；剪枝序列为树的序号为键的dict，
+        含有训练数据时剪枝后重新计算OOB误差
+    - save(path), RandomForest.load(path,mmap)
+        保存和读取训练好的模型，见DecisionTree
+    - predict_one(row)
+        单行预测的快速路径，见DecisionTree
+    - predict_proba(data,n_jobs)
+        用于计算data投给各类别的票数比例
+        输出：
+        - 形如(行数,类别数)的矩阵，列的顺序与self.categories相同
     """
 
-    def __init__(self, data, cat_name):
-        super().__init__(data,cat_name)
+    def __init__(self, data, cat_name, random_state=None, dtype=np.float64, order='C'):
+        super().__init__(data,cat_name,random_state,dtype,order)
+        self._trees=None
+        # 投票时票数相同的类别之间随机选择所用的种子
+        self._vote_seed=None
+        # 训练时得到的参数与OOB结果，由tree直接设置决策树时保持为None
+        self.subf_num=None
+        self.oob_error=None
+        self.oob_decision_function=None
+        self.oob_confusion_matrix=None
+        self._inbag=None
 
+    @property
+    def tree(self):
+        """dict形式的全部决策树，键为树的序号"""
+        if self._trees is not None:
+            return {i:tree.to_dict() for i,tree in enumerate(self._trees)}
+
+    @tree.setter
+    def tree(self,tree):
+        if tree is None:
+            self._trees=None
+        else:
+            self._trees=[CompiledTree.from_dict(tree[i]) for i in sorted(tree)]
+
+    def _compiled_trees(self):
+        """模型中以数组储存的全部决策树"""
+        return [] if self._trees is None else self._trees
+
+    def _set_compiled_trees(self,trees):
+        """设置模型中以数组储存的决策树"""
+        self._trees=trees
+        self.num_tree=len(trees)
+
+    def _model_info(self):
+        """保存模型时需要记录的参数"""
+        info=super()._model_info()
+        info['subf_num']=self.subf_num
+        info['oob_error']=None if self.oob_error is None else float(self.oob_error)
+        # 记录投票时所用的种子，读取后票数相同时的选择不变
+        if self._vote_seed is None:
+            info['vote_seed']=None
+        else:
+            info['vote_seed']=[self._vote_seed.entropy,list(self._vote_seed.spawn_key)]
+        return info
 
-    def _split_feature(self, data):
+    def _restore(self,header,arrays):
+        """由模型文件的内容恢复模型（不含训练数据和OOB的逐行结果）"""
+        super()._restore(header,arrays)
+        info=header['info']
+        self.subf_num=info['subf_num']
+        self.oob_error=info['oob_error']
+        self.oob_decision_function=None
+        self.oob_confusion_matrix=None
+        self._inbag=None
+        if info['vote_seed'] is None:
+            self._vote_seed=None
+        else:
+            entropy,spawn_key=info['vote_seed']
+            self._vote_seed=np.random.SeedSequence(entropy,spawn_key=tuple(spawn_key))
+
+    def _candidate_features(self):
         """重写该函数，在决策树基础上增加随机选择子特征的过程"""
-        smallest = 1
         # 随机选择一些特征作为候选划分特征
-        subfeatures=ra.sample(range(self.columns_num - 1),self.subf_num)
-        for element in subfeatures:
-            # 获取element对应特征的最佳划分点和最小GINI
-            (x, f) = self._split_criteria(data, element)
-            # 保留最小的GINI和对应的划分点
-            if f < smallest:
-                smallest = f
-                split_feature = element
-                split_criteria = x
-        if smallest == 1:
-            # 说明没能划分（避免所有值都相同，但类别不同的数据的情况）
-            split_feature, split_criteria = 'none', 'none'
-        return split_feature, split_criteria
-
-    def train(self,num_tree,max_depth=0,min_gini=0,subf_num=0):
+        return self._rng.choice(self.columns_num - 1,self.subf_num,replace=False).tolist()
+
+    def train(self,num_tree,max_depth=0,min_gini=0,subf_num=0,binning=0,n_jobs=1,random_state=None,
+              min_samples_split=2,min_samples_leaf=1,max_leaf_nodes=0,min_impurity_decrease=0,
+              growth='depth'):
         """
         对所给数据构建随机森林
         参数：
@@ -65,66 +171,242 @@ class RandomForest(DecisionTree):
             max_depth: 单棵树深度的最大值，达到最大值后停止构建子树，默认为无穷大，即不设置深度限制
             mini_gini：损失函数的最小值，达到最小值后停止构建子树，默认为0
             subf_num: Forest—RI中每次划分用的子特征数，默认为总特征数的根号取整
+            binning: 分箱个数（不超过255），用各箱的直方图寻找划分点，默认为0即不分箱
+            n_jobs: 同时训练决策树的进程数，-1为使用全部CPU，默认为1即不使用多进程
+            random_state: 随机种子，每棵树使用由它派生的独立随机数流，因此结果与进程数无关，
+                          默认为None即使用构造时给出的random_state
+            min_samples_split, min_samples_leaf, max_leaf_nodes, min_impurity_decrease:
+                单棵树的预剪枝条件，见DecisionTree.train，样本数计入bootstrap重复抽中的次数
+            growth: 单棵树的建树顺序，见DecisionTree.train
         """
-        # 初始化数结构和参数
-        self.tree={}
-        oob_tests=[]
-        if max_depth>0:
-            input_max_d=max_depth
-        else:
-            input_max_d=2*self.rows_num
+        self._check_trainable()
+        # 初始化参数
+        limits=self._tree_limits(max_depth,min_gini,min_samples_split,min_samples_leaf,
+                                 max_leaf_nodes,min_impurity_decrease,growth)
         self.num_tree=num_tree
         if subf_num>0 and isinstance(subf_num,int):
             self.subf_num=subf_num
         else:
             self.subf_num=int(round(np.sqrt(self.columns_num)))
-        # 训练全部决策树
-        for i in range(num_tree):
-            # 从全部样本中有放回抽出样本个数个子样本
-            boots=ra.choices(range(self.rows_num),k=self.rows_num)
-            boot_data=self.data[boots]
-            self.tree[i]=self._treeRecursion(boot_data,min_gini,0,input_max_d)
-            # 收集OOB样本
-            oob_tests.append(self._oob_test(self.tree[i],boots))
-        # 计算总体OOB误差
-        self.oob_error=np.mean(oob_tests)
-
-    def _oob_test(self,tree,boots):
-        """OOB测试预测能力"""
-        # 取出全样本与bootstrap子样本的补集
-        oob=list(set(range(self.rows_num))-set(boots))
-        oob_data=self.data[oob]
-        # 对于输入data为向量的情况
-        if self.data.ndim == 1:
-            result = self._search(tree, oob_data)
-        # 对于输入data为矩阵的情况
+        if n_jobs<0:
+            n_jobs=os.cpu_count()
+        # 每棵树的随机种子，由模型的种子派生出相互独立的随机数流
+        seed_seq=self._seed_sequence(random_state)
+        seeds=seed_seq.spawn(num_tree)
+        # 各特征只在开始时排序（或分箱）一次，所有树共用
+        x,y=self._training_arrays()
+        if binning:
+            sorted_index,binned=None,self._bin_features(x,binning)
+        else:
+            sorted_index,binned=self._presort(x),None
+        if n_jobs>1 and num_tree>1:
+            # 训练数据放在共享内存中，子进程直接读取，不随每个任务传递
+            codes,edges=binned if binned else (None,None)
+            specs=[_to_shared(array) for array in (x,y,sorted_index,codes)]
+            del x,sorted_index,codes,binned
+            forest=self._worker_copy()
+            with mp.Pool(min(n_jobs,num_tree),_init_worker,(forest,specs,edges)) as pool:
+                votes=self._collect_trees(pool.imap(_train_tree,[(seed,limits) for seed in seeds]))
         else:
-            f = lambda x: self._search(tree, x)
-            result = list(map(f, oob_data))
-        mat=self._compare(oob_data[:,-1],result)
-        error=1-np.trace(mat)/len(oob_data)
-        return error
-
-    def _vote(self,data):
-        """将数据向量输入随机森林中每棵树得到多个结果，投票出选择最多的结果"""
-        preds=[]
-        for i in range(self.num_tree):
-            # 遍历每棵树，将分类结果添加到preds中
-            preds.append(self._search(self.tree[i],data))
-        # 归票，选择投票最多的类别
-        result=self._classify(preds)
+            votes=self._collect_trees(self._train_tree(seed,x,y,sorted_index,binned,limits)
+                                      for seed in seeds)
+        # 投票时使用的随机数流，与是否使用多进程无关
+        self._vote_seed=seed_seq.spawn(1)[0]
+        # 计算总体OOB误差
+        self._oob_score(y,votes)
+
+    def _collect_trees(self,results):
+        """
+        按顺序收集各树的训练结果，每得到一棵树即把它对OOB样本的预测累加到票数中，
+        不保留各树的OOB预测，返回每行的OOB投票，形如(行数,类别数)
+        """
+        trees,inbags=[],[]
+        votes=np.zeros((self.rows_num,len(self.categories)),dtype=np.int32)
+        for tree,inbag,oob_pred in results:
+            trees.append(tree)
+            inbags.append(inbag)
+            # 每棵树的OOB行互不相同，可以直接按位置加一
+            votes[self._unpack_oob(inbag),oob_pred]+=1
+        self._trees=trees
+        # 各树bootstrap中抽中各行的位图，形如(树数,行数/8)
+        self._inbag=np.array(inbags)
+        return votes
+
+    def _worker_copy(self):
+        """复制一个不含数据的随机森林，用于传给子进程"""
+        forest=copy.copy(self)
+        forest.x=None
+        forest.y=None
+        forest._trees=None
+        # 上一次训练的OOB结果与行数成正比，不传给子进程
+        forest._inbag=None
+        forest.oob_decision_function=None
+        forest.oob_confusion_matrix=None
+        forest._predictor=None
+        forest._pruning=None
+        forest.test_data=None
+        forest.confusion_matrix=None
+        forest.metrics=None
+        return forest
+
+    def _train_tree(self,seed,x,y,sorted_index,binned,limits):
+        """
+        用给定的随机种子训练一棵决策树，
+        返回决策树、bootstrap中抽中各行的位图以及对未抽中各行（OOB样本）的预测
+        """
+        self._rng=np.random.default_rng(seed)
+        # 从全部样本中有放回抽出样本个数个子样本
+        # 以每行被抽中的次数作为权重，不复制数据
+        boots=self._rng.integers(0,self.rows_num,self.rows_num)
+        weight=np.bincount(boots,minlength=self.rows_num).astype(float)
+        self._set_training(x,y,weight,sorted_index,binned)
+        tree=self._build_tree(limits)
+        self._clear_training()
+        oob=np.flatnonzero(weight==0)
+        return tree,np.packbits(weight>0),tree.predict(x[oob])
+
+    def _unpack_oob(self,inbag):
+        """由bootstrap中抽中各行的位图得到未被抽中的行"""
+        return np.flatnonzero(np.unpackbits(inbag)[:self.rows_num]==0)
+
+    def _oob_rows(self,i):
+        """第i棵树bootstrap中未被抽中的行"""
+        return self._unpack_oob(self._inbag[i])
+
+    def _oob_score(self,y,votes):
+        """由每行的OOB投票，形如(行数,类别数)，计算整体OOB误差"""
+        total=votes.sum(axis=1)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            self.oob_decision_function=votes/total[:,None]
+        # 只对至少被一棵树作为OOB样本的行计算误差
+        has_oob=total>0
+        result=self._majority(votes[has_oob],None)
+        self.oob_confusion_matrix=self._compare(y[has_oob],result)
+        self.oob_error=1-np.trace(self.oob_confusion_matrix)/np.count_nonzero(has_oob)
+
+    def _permutation_drop(self,i,n_repeats,seed):
+        """
+        第i棵树在它的OOB样本上打乱各特征后准确率的下降，形如(n_repeats,特征数)
+        同一特征的n_repeats次打乱叠成一个矩阵，一次预测
+        """
+        rows=self._oob_rows(i)
+        x,y=self.x[rows],self.y[rows]
+        tree=self._trees[i]
+        base=np.mean(tree.predict(x)==y)
+        rng=np.random.default_rng(seed)
+        drop=np.empty((n_repeats,x.shape[1]))
+        y_repeat=np.tile(y,n_repeats)
+        for feature in range(x.shape[1]):
+            permuted=np.tile(x,(n_repeats,1))
+            # 每次打乱为OOB样本行号的一个随机排列
+            order=np.argsort(rng.random((n_repeats,len(rows))),axis=1)
+            permuted[:,feature]=x[order.ravel(),feature]
+            correct=(tree.predict(permuted)==y_repeat).reshape(n_repeats,-1).mean(axis=1)
+            drop[:,feature]=base-correct
+        return drop
+
+    def permutation_importance(self,n_repeats=5,n_jobs=1,random_state=None):
+        """
+        OOB置换重要性：对每棵树，在它的OOB样本上逐个打乱各特征，计算该树准确率的下降，再对各树平均
+        参数：
+            n_repeats: 每个特征打乱的次数，默认为5
+            n_jobs: 同时计算的线程数（各树分开计算），-1为使用全部CPU，默认为1即不使用多线程
+            random_state: 随机种子，每棵树使用由它派生的独立随机数流，因此结果与线程数无关，
+                          默认为None即使用构造时给出的random_state
+        """
+        self._check_trainable()
+        if self._trees is None or self._inbag is None:
+            raise ValueError("The model is not trained.")
+        seeds=self._seed_sequence(random_state).spawn(len(self._trees))
+        # 没有OOB样本的树不参与计算
+        trees=[i for i in range(len(self._trees)) if len(self._oob_rows(i))]
+        if n_jobs<0:
+            n_jobs=os.cpu_count()
+        with ThreadPoolExecutor(max(n_jobs,1)) as pool:
+            drops=list(pool.map(lambda i:self._permutation_drop(i,n_repeats,seeds[i]),trees))
+        drop=np.mean(drops,axis=0)
+        return pd.DataFrame({'importance':drop.mean(axis=0),'std':drop.std(axis=0)},
+                            index=self.features[:-1])
+
+    def cost_complexity_path(self):
+        """各树的最弱连接剪枝序列，键为树的序号，见DecisionTree"""
+        return {i:self._path_table(path) for i,path in enumerate(self._pruning_paths()['paths'])}
+
+    def prune(self,alpha):
+        """各树按同一个alpha剪枝，见DecisionTree"""
+        summary=super().prune(alpha)
+        if self.x is not None and self._inbag is not None:
+            # 用剪枝后的树重新计算OOB误差，逐棵树累加票数
+            votes=np.zeros((self.rows_num,len(self.categories)),dtype=np.int32)
+            for i,tree in enumerate(self._trees):
+                rows=self._oob_rows(i)
+                votes[rows,tree.predict(self.x[rows])]+=1
+            self._oob_score(self.y,votes)
+        return summary
+
+    def _vote_count(self,data):
+        """将数据矩阵输入随机森林中每棵树，统计各行投给各类别的票数，形如(行数,类别数)"""
+        rows=np.arange(len(data))
+        count=np.zeros((len(data),len(self.categories)),dtype=np.int32)
+        for tree in self._trees:
+            # 每棵树对所有行同时预测，每行对应类别加一票
+            count[rows,tree.predict(data)]+=1
+        return count
+
+    def _tie_rng(self,random_state):
+        """投票时票数相同的类别之间随机选择所用的随机数生成器，同样的种子每次给出同样的结果"""
+        if random_state is None and self._vote_seed is not None:
+            return np.random.default_rng(self._vote_seed)
+        return np.random.default_rng(self._seed_sequence(random_state))
+
+    def _predict_with_proba(self,data):
+        """一次计票，同时得到预测类别与票数比例"""
+        count=self._vote_count(data)
+        return self._majority(count,None),count/len(self._trees)
+
+    def _tie_noise(self,random_state=None):
+        """
+        票数相同的类别之间选择所用的随机数，长度为类别个数，选择其中最大的
+        每个模型（及random_state）只有一组，即固定的类别优先顺序，
+        因此每行的结果与同批的其他行、分块方式以及是否单行预测无关
+        """
+        return self._tie_rng(random_state).random(len(self.categories))
+
+    def _majority(self,count,random_state):
+        """由各行投给各类别的票数选择票数最多的类别"""
+        if len(count)==0:
+            return np.zeros(0,dtype=np.intp)
+        # 选择各行票数最多的类别
+        best=count==count.max(axis=1)[:,None]
+        result=np.argmax(best,axis=1)
+        # 如果有多个类别票数相等且最多，按随机的类别优先顺序选择其中一个
+        tie=np.count_nonzero(best,axis=1)>1
+        if tie.any():
+            noise=self._tie_noise(random_state)
+            result[tie]=np.argmax(np.where(best[tie],noise,-1),axis=1)
         return result
 
-    def predict(self,data):
-        """预测给定data对应类别"""
-        if self.tree!=None:
+    def predict(self,data,n_jobs=1,*,random_state=None):
+        """
+        预测给定data对应类别，data为矩阵时返回np.array，参数顺序同DecisionTree.predict，random_state只能按名字给出
+        票数相同的类别之间按由random_state随机得到的固定类别优先顺序选择，每行的结果与同批的其他行无关，
+        random_state默认为None即使用训练时给出的random_state
+        n_jobs为按行分块同时计票的线程数，-1为使用全部CPU，默认为1即不使用多线程，结果与线程数无关
+        """
+        if self._trees is not None:
             #对于输入data为向量的情况
             if data.ndim==1:
-                result=self._vote(data)
+                result=int(self.predict(data[None],random_state=random_state)[0])
             # 对于输入data为矩阵的情况
             else:
-                result=[]
-                for element in data:
-                    result.append(self._vote(element))
+                count=self._map_rows(self._vote_count,self._feature_matrix(data),n_jobs)
+                result=self._majority(count,random_state)
             return result
 
+    def predict_proba(self,data,n_jobs=1):
+        """计算给定data投给各类别的票数比例，列的顺序与self.categories相同，n_jobs见predict"""
+        if self._trees is not None:
+            if data.ndim==1:
+                return self.predict_proba(data[None])[0]
+            count=self._map_rows(self._vote_count,self._feature_matrix(data),n_jobs)
+            return count/len(self._trees)
@@ -1,31 +1,160 @@
 import numpy as np
 import pandas as pd
 
-def central_standard(df):
+def central_standard(df, out=None, dtype=None):
     """
     Get the centalised and standardised numpy array
 
+    The columns are centred and scaled by their standard deviations
+    in a single n*p array, without intermediate copies.
+
     Parameters:
-     - df: A pandas DataFrame
+     - df: A pandas DataFrame or a 2-d numpy array
+     - out: An n*p array to hold the result, can be the data itself
+       to standardise in place; a new array if None
+     - dtype: Type of a new result, e.g. np.float32 to halve the memory;
+       float64 if None. The sums are always accumulated in float64
     """
-    x = df.values
+    x = df.values if isinstance(df, pd.DataFrame) else np.asarray(df)
+    if out is None:
+        out = np.empty(x.shape, dtype=dtype or np.float64)
     # Centralisation
-    y = x - np.mean(x, axis=0)
-    # Calculate the covariance matrix
-    s = np.dot(np.transpose(y), y) / (x.shape[0] - 1)
-    # Standardisation
-    d = np.diag(s.diagonal()**(-1 / 2))
-    z = np.dot(y, d)
-    return z
+    np.subtract(x, np.mean(x, axis=0, dtype=np.float64), out=out, casting='unsafe')
+    # Standardisation by the column standard deviations
+    s = np.einsum('ij,ij->j', out, out, dtype=np.float64) / (x.shape[0] - 1)
+    out *= (1 / np.sqrt(s)).astype(out.dtype)
+    return out
+
+def cross_product(z, block=4096):
+    """
+    Get z^T z accumulated in float64
+
+    Arrays of lower precision, e.g. float32, are converted block by block,
+    so the product keeps float64 precision without a full float64 copy.
+
+    Parameters:
+     - z: A 2-d numpy array
+     - block: Number of rows converted at a time
+    """
+    if z.dtype == np.float64:
+        return np.dot(z.T, z)
+    s = np.zeros((z.shape[1], z.shape[1]))
+    for start in range(0, len(z), block):
+        y = z[start:start + block].astype(np.float64)
+        s += np.dot(y.T, y)
+    return s
 
-def corr_mtx(df):
+def cross_to_corr(s):
+    """
+    Scale a matrix of centred cross-products, or a covariance matrix,
+    to the correlation matrix with an exact unit diagonal
+
+    Parameters:
+     - s: A p*p numpy array
+    """
+    d = 1 / np.sqrt(s.diagonal())
+    corr = s * d * d[:, None]
+    np.fill_diagonal(corr, 1)
+    return corr
+
+def corr_mtx(df, dtype=None):
     """
     Get the correlation matrix
     
     Parameters:
      - df: A pandas DataFrame
+     - dtype: Type of the standardised data, see central_standard();
+       the matrix itself is always computed in float64
+    """
+    z = central_standard(df, dtype=dtype)
+    # Rescaling by the diagonal also removes the rounding of the scales in float32
+    cor_matrix = cross_to_corr(cross_product(z))
+    return cor_matrix
+
+class CorrAccumulator():
+    """
+    Streaming covariance and correlation matrix
+
+    The count, means and centred cross-products of every chunk are merged
+    with the pairwise update of Chan et al., so the data is never held in
+    memory at once and no large sums of squares are subtracted.
+
+    Usage:
+        acc = CorrAccumulator()
+        for chunk in pd.read_csv(path, chunksize=10000):
+            acc.update(chunk)
+        fa = FactorAnalysis.from_corr(acc.corr, acc.n, acc.columns)
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.columns = None
+        self.mean = None
+        self._m2 = None
+
+    def _merge(self, n, mean, m2):
+        if self.n == 0:
+            self.n, self.mean, self._m2 = n, mean, m2
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self._m2 = self._m2 + m2 + np.outer(delta, delta) * (self.n * n / total)
+        self.n = total
+
+    def update(self, chunk):
+        """
+        Add the rows of a chunk
+
+        Parameters:
+         - chunk: A pandas DataFrame or a 2-d numpy array, with the same
+           columns in every chunk
+        """
+        if isinstance(chunk, pd.DataFrame):
+            if self.columns is None:
+                self.columns = chunk.columns
+            chunk = chunk.values
+        x = np.asarray(chunk, dtype=float)
+        if len(x) == 0:
+            return self
+        mean = np.mean(x, axis=0)
+        y = x - mean
+        self._merge(len(x), mean, np.dot(y.T, y))
+        return self
+
+    def merge(self, other):
+        """
+        Add the rows accumulated by another CorrAccumulator
+        """
+        if other.n > 0:
+            if self.columns is None:
+                self.columns = other.columns
+            self._merge(other.n, other.mean, other._m2)
+        return self
+
+    @property
+    def cov(self):
+        """The sample covariance matrix"""
+        return self._m2 / (self.n - 1)
+
+    @property
+    def corr(self):
+        """The correlation matrix"""
+        return cross_to_corr(self._m2)
+
+
+def corr_stream(chunks):
+    """
+    Get the correlation matrix of data read in chunks
+
+    Parameters:
+     - chunks: An iterable of pandas DataFrames or numpy arrays, e.g.
+       pd.read_csv(path, chunksize=10000)
+
+    Returns:
+     - A CorrAccumulator, with the matrix in .corr and the rows in .n
     """
-    n, p = df.shape
-    z = central_standard(df)
-    cor_matrix = np.dot(z.T, z) / (n - 1)
-    return cor_matrix
\ No newline at end of file
+    acc = CorrAccumulator()
+    for chunk in chunks:
+        acc.update(chunk)
+    return acc
@@ -1,3 +1,4 @@
+import numpy as np
 from .settings import Settings
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -20,9 +21,12 @@ def plot_eigenvalues(mtx):
     Barplot of sorted eigenvalues
     
     Parameters:
-     - mtx: A squared matrix; numpy array
+     - mtx: A squared matrix, or its eigenvalues; numpy array
     """
-    values = np.linalg.eigvals(mtx)
+    if np.ndim(mtx) == 2:
+        values = np.linalg.eigvals(mtx)
+    else:
+        values = np.asarray(mtx)
     sorted_indices = np.argsort(values)[::-1]
     values = values[sorted_indices]
     k = len(values)